@@ -0,0 +1,124 @@
+"""Import-time benchmark guarding the startup of the liner-notes command line
+
+Each case runs in a fresh interpreter, so nothing is already imported:
+
+    python -m liner_notes.bench
+    python -m liner_notes.bench --budget 0.1 --output startup.json
+
+Exits 1 when a case imports a framework it must not, or its imports take
+longer than the budget.
+
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+# frameworks that take seconds to import
+HEAVY = ('torch', 'transformers', 'datasets')
+# needed by `clean` itself, but not before a subcommand runs
+DATA = ('numpy', 'pandas', 'pyarrow')
+
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    'seconds': elapsed,
+    'imported': [m for m in {modules!r} if m in sys.modules],
+}}))
+'''
+
+
+def cases(infile, outfile):
+    # (name, statement, modules it must not import, timed against the budget)
+    help = 'from liner_notes import cli\ntry:\n    cli.main({argv!r})\nexcept SystemExit:\n    pass'
+    return [
+        ('import cli', 'from liner_notes import cli', HEAVY + DATA, True),
+        ('liner-notes --help', help.format(argv=['--help']), HEAVY + DATA, True),
+        ('liner-notes clean --help', help.format(argv=['clean', '--help']), HEAVY + DATA, True),
+        ('liner-notes evaluate --help', help.format(argv=['evaluate', '--help']), HEAVY, False),
+        ('liner-notes serve --help', help.format(argv=['serve', '--help']), HEAVY, False),
+        ('liner-notes clean', 'from liner_notes import cli\n'
+                              f'cli.main({["clean", infile, outfile]!r})', HEAVY, False),
+    ]
+
+
+def probe(statement, modules):
+    code = PROBE.format(statement=statement, modules=tuple(modules))
+    out = subprocess.run(
+        [sys.executable, '-c', code],
+        capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def run(budget=0.05, repeat=3, verbose=False):
+    """Time each case and list the frameworks it imported.
+
+    Parameters
+    ----------
+    budget : float, default 0.05
+        seconds the cases that must not import pandas may spend importing
+    repeat : int, default 3
+        best-of-n timing
+    verbose : bool, default False
+        if True prints each case to stdout
+
+    Returns
+    -------
+    results : dict
+        case name -> seconds, imported, budget and ok
+
+    """
+    from liner_notes.data import synthetic
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        infile = os.path.join(tmp, 'mail.csv')
+        outfile = os.path.join(tmp, 'clean.csv')
+        synthetic.frame(20, seed=0).to_csv(infile, index=False)
+
+        for name, statement, modules, timed in cases(infile, outfile):
+            runs = [probe(statement, modules) for _ in range(repeat)]
+            seconds = min(r['seconds'] for r in runs)
+            imported = runs[0]['imported']
+            ok = not imported and (not timed or seconds <= budget)
+            results[name] = {
+                'seconds': seconds,
+                'imported': imported,
+                'budget': budget if timed else None,
+                'ok': ok,
+            }
+            if verbose:
+                flag = 'ok' if ok else 'FAIL'
+                extra = f"  imported {', '.join(imported)}" if imported else ''
+                print(f'{name:32s} {seconds:8.4f}s  {flag}{extra}')
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--budget', type=float, default=0.05,
+                        help='seconds allowed before a subcommand runs')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args(argv)
+
+    results = run(args.budget, args.repeat, verbose=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    return 0 if all(r['ok'] for r in results.values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""liner-notes command line -- clean, train, evaluate, generate and serve
+
+Every subcommand imports what it needs only once it runs, so `clean`
+never loads torch, transformers or datasets and `--help` loads nothing:
+
+    liner-notes clean garagiste_wine.csv garagiste_wine_clean.csv --state ingest.sqlite
+    liner-notes train
+    liner-notes evaluate ./checkpoint-1500 ../data/test.csv predictions.csv
+    liner-notes generate ./checkpoint-1500 '1999 chevillon nuit saints georges villages france'
+    liner-notes serve --checkpoint ./checkpoint-1500 --port 8000
+
+"""
+
+import argparse
+import sys
+
+
+def clean(argv):
+    parser = argparse.ArgumentParser(prog='liner-notes clean',
+                                     description='clean raw garagiste emails into name, note rows')
+    parser.add_argument('infile', help='CSV with date and message columns')
+    parser.add_argument('outfile', help="cleaned '.csv', '.arrow' or '.parquet'")
+    parser.add_argument('--workers', type=int, default=1, help='0 uses every core')
+    parser.add_argument('--chunksize', type=int, default=1000)
+    parser.add_argument('--cache', help='SQLite cache of cleaned messages')
+    parser.add_argument('--state', help='SQLite watermark, appends only new mail to a CSV')
+    parser.add_argument('--backend', choices=['engine', 'vectorized'], default='engine')
+    parser.add_argument('--near-duplicates', type=float, metavar='JACCARD')
+    parser.add_argument('--profile', help='JSON report of time spent per rule')
+    args = parser.parse_args(argv)
+
+    from liner_notes.data.garagiste import clean
+
+    df = clean(
+        args.infile, args.outfile,
+        workers=args.workers or None,
+        chunksize=args.chunksize,
+        cache=args.cache,
+        profile=args.profile,
+        backend=args.backend,
+        near_duplicates=args.near_duplicates,
+        state=args.state,
+    )
+    print(f'wrote {len(df)} rows to {args.outfile}')
+
+    return 0
+
+
+def train(argv):
+    parser = argparse.ArgumentParser(
+        prog='liner-notes train',
+        description='run the ed.py training script from the current directory -- it reads '
+                    '../data/garagiste_wine_clean.arrow and writes checkpoints to ./',
+    )
+    parser.parse_args(argv)
+
+    import runpy
+
+    # ed.py trains at module level, settings are edited in the script
+    runpy.run_module('liner_notes.model.ed', run_name='__main__')
+
+    return 0
+
+
+def evaluate(argv):
+    from liner_notes.model import evaluate
+
+    return evaluate.main(argv, prog='liner-notes evaluate')
+
+
+def generate(argv):
+    parser = argparse.ArgumentParser(prog='liner-notes generate',
+                                     description='describe labels given or read from a file')
+    parser.add_argument('checkpoint')
+    parser.add_argument('names', nargs='*', help='labels to describe')
+    parser.add_argument('--infile', help="'.csv', '.parquet' or '.arrow' with a name column")
+    parser.add_argument('--outfile', help='name, description CSV written for --infile')
+    parser.add_argument('--tokenizer', default='bert-base-uncased')
+    parser.add_argument('--workers', type=int, help='processes for --infile, default one per core')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--num-beams', type=int)
+    parser.add_argument('--cache-file', help='SQLite generation cache')
+    parser.add_argument('--index', help='retrieval index consulted before generating')
+    parser.add_argument('--threshold', type=float, default=0.9)
+    args = parser.parse_args(argv)
+
+    if bool(args.infile) != bool(args.outfile):
+        parser.error('--infile and --outfile go together')
+    if not args.names and not args.infile:
+        parser.error('give names or --infile')
+
+    generate_kwargs = {'num_beams': args.num_beams} if args.num_beams else {}
+
+    if args.infile:
+        from liner_notes.model.shard import backfill
+
+        rows = backfill(args.checkpoint, args.infile, args.outfile, args.tokenizer,
+                        workers=args.workers, batch_size=args.batch_size,
+                        cache_file=args.cache_file, index_file=args.index,
+                        threshold=args.threshold, verbose=True, **generate_kwargs)
+        print(f'wrote {rows} rows to {args.outfile}')
+
+    if args.names:
+        from liner_notes.model.cache import GenerationCache, checkpoint_identity, generation_params
+        from liner_notes.model.describe import describe, load_model
+        from liner_notes.model.retrieval import RetrievalIndex
+
+        tokenizer, ed_model = load_model(args.checkpoint, args.tokenizer)
+        cache = GenerationCache(checkpoint_identity(args.checkpoint),
+                                generation_params(ed_model, **generate_kwargs),
+                                path=args.cache_file)
+
+        def model(misses):
+            return describe(misses, tokenizer, ed_model, args.batch_size, **generate_kwargs)
+
+        # the index first, then the cache, as evaluate and serve do
+        with cache:
+            if args.index:
+                index = RetrievalIndex.load(args.index)
+                descriptions = index.describe(
+                    args.names, lambda misses: cache.describe(misses, model), args.threshold,
+                )
+            else:
+                descriptions = cache.describe(args.names, model)
+        for name, description in zip(args.names, descriptions):
+            print(f'NAME\n{name}\n\nDESCRIPTION\n{description}\n')
+
+    return 0
+
+
+def serve(argv):
+    from liner_notes.model import serve
+
+    return serve.main(argv, prog='liner-notes serve')
+
+
+COMMANDS = {
+    'clean': (clean, 'clean raw emails into the training corpus'),
+    'train': (train, 'train the encoder-decoder (model/ed.py)'),
+    'evaluate': (evaluate, 'resumable ROUGE-2 evaluation of a checkpoint'),
+    'generate': (generate, 'describe labels, or a whole catalog on every core'),
+    'serve': (serve, 'HTTP generation server with micro-batching'),
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='liner-notes', description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name, (_, help) in COMMANDS.items():
+        # each subcommand parses its own arguments, --help included
+        commands.add_parser(name, help=help, add_help=False)
+
+    args, rest = parser.parse_known_args(argv)
+    func, _ = COMMANDS[args.command]
+
+    return func(rest)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,182 @@
+"""The original cleaning pipeline, frozen, to check the engine against
+
+garagiste.clean_message and the compiled ENGINE have both been reworked
+for speed; this module keeps the code path they replaced so their
+output can be diffed against it:
+
+    python -m liner_notes.data.baseline garagiste_wine.csv
+
+Only the rule tables are shared with garagiste -- changing a rule on
+purpose changes both sides.
+
+"""
+
+import html
+import re
+import sys
+
+from liner_notes.data import garagiste
+
+# inputs whose output depends on details the rewrites are prone to
+# change: numeric entities that unescape to upper-case ascii (the rules
+# never ignored case), more matches than a rule's count, text the guards
+# and fused rules skip, and text the vectorized backend's regex engine
+# reads differently
+CASES = [
+    '2009 Foo - $5\nIt is &#87;&#83;92 points',
+    '2009 Foo - $5\nbuy &#51;&#88; now and 3x later',
+    'NV Bar &#49;&#53;&#48;&#48;&#77;&#76; 750ml - $12\n6X 375ml 2 x 750ml 4x',
+    '2019 Baz - $9\n&#72;&#84;&#84;&#80;://example.com and http://example.com',
+    '2015 Qux - $30\n90&#80;&#84;&#83; 91pts 92pts 93pts wa95 &#87;&#65;96 ws97 iwc98',
+    '2018 Quux - $8\nwow! wow! wow! 5% 6% 7% #1 #2 #3 a&b c&d e&f 1-2 3-4 5-6',
+    '2012 Corge - $1,234.56\n$5 $6 $7 1/2 3/4 5/6 ... .... word - word - word',
+    'no label here\n!!!!!!! ------- dear friends keep this thank you drop this',
+    # whitespace to Python but not to pyarrow's RE2, and non-ascii letters
+    # the two lower-case differently
+    '2014 Grault\x1c3 x Cuv\xe9e - $20\nsoft\x0bfruit\x1f&\x1cspice 2\x1c-\x1c3',
+    '2016 \u0130nan \u1e9e \u212a\xc5 - $15\n\u0130STANBUL \u03a3\u039f\u03a3 caf\xc9 & co',
+]
+
+
+def resub(name, s, replacement=''):
+    # re.IGNORECASE lands in `count`, as it always did
+    return re.sub(garagiste.PATTERNS[name], replacement, s, re.IGNORECASE)
+
+
+def get_label(s):
+    result = re.search(garagiste.PATTERNS['LABEL'], s, re.IGNORECASE)
+    msg = result.group(1) if result else 'empty'
+
+    msg = resub('FORMAT', msg)
+    msg = resub('QUANTITY', msg)
+    msg = re.sub(garagiste.PATTERNS['SYMBOL'], '', msg)
+
+    return msg
+
+
+def trim_after(s, pattern):
+    try:
+        idx = s.index(pattern) + len(pattern)
+    except ValueError:
+        idx = 0
+    return s[idx:].strip()
+
+
+def trim_before(s, pattern):
+    try:
+        idx = s.index(pattern)
+    except ValueError:
+        idx = -1
+    return s[:idx].strip()
+
+
+def delete_lines_with_string(s, patterns):
+    keepers = []
+    for line in s.split('\n'):
+        if not any(pattern in line for pattern in patterns):
+            keepers.append(line)
+    return ' '.join(keepers)
+
+
+def replace(s, patterns, replacement=''):
+    for name in patterns:
+        s = s.replace(name, replacement)
+    return s
+
+
+def clean_message(s):
+    msg = s.lower()
+    msg = html.unescape(msg)
+    msg = msg.translate(garagiste.TRANSLATION)
+    msg = msg.encode('ascii', 'ignore').decode()
+
+    label = get_label(msg)
+
+    msg = trim_after(msg, 'dear friends')
+    msg = trim_before(msg, 'thank you')
+    msg = trim_before(msg, 'to order')
+
+    msg = delete_lines_with_string(msg, garagiste.UNWANTED_LINES)
+    msg = replace(msg, garagiste.UNWANTED_ENTITIES)
+
+    msg = resub('POINTS', msg, 'amazing')
+    msg = resub('PRICE', msg, r'\2 usd')
+    msg = resub('QUANTITY', msg)
+    msg = resub('SCORE', msg)
+    msg = resub('URL', msg)
+
+    msg = resub('AMPERSAND', msg, ' and ')
+    msg = resub('DASH', msg, ' to ')
+    msg = resub('ELLIPSIS', msg, ' ')
+    msg = resub('ENDASH', msg)
+    msg = resub('EXCLAIM', msg, '.')
+    msg = resub('PERCENT', msg, ' percent')
+    msg = resub('POUND', msg, ' number ')
+    msg = resub('SLASH', msg, ' and ')
+
+    msg = re.sub(garagiste.PATTERNS['SYMBOL'], '', msg)
+
+    msg = resub('RUN_ON', msg, '')
+
+    note = ' '.join(msg.split())
+
+    return label, note
+
+
+def check(messages=(), verbose=False):
+    """Diff the reference, the engine and the vectorized backend against the baseline.
+
+    Parameters
+    ----------
+    messages : sequence, default ()
+        raw email bodies, checked together with CASES
+    verbose : bool, default False
+        if True prints every mismatch to stdout
+
+    Returns
+    -------
+    mismatches : dict
+        implementation -> number of messages whose (label, note) differs
+
+    """
+    import pandas as pd
+
+    from liner_notes.data import vectorized
+
+    messages = CASES + list(messages)
+    expected = [clean_message(msg) for msg in messages]
+    labels, notes = vectorized.clean_series(pd.Series(messages), garagiste.ENGINE)
+
+    outputs = {
+        'garagiste.clean_message': [garagiste.clean_message(msg) for msg in messages],
+        'ENGINE.clean_message': [garagiste.ENGINE.clean_message(msg) for msg in messages],
+        'vectorized.clean_series': list(zip(labels, notes)),
+    }
+
+    mismatches = {}
+    for name, actual in outputs.items():
+        mismatches[name] = 0
+        for msg, a, e in zip(messages, actual, expected):
+            if tuple(a) != e:
+                mismatches[name] += 1
+                if verbose:
+                    print(f'{name} differs on {msg!r}\n  baseline: {e}\n  got:      {tuple(a)}')
+
+    return mismatches
+
+
+def main(argv=None):
+    import pandas as pd
+
+    argv = sys.argv[1:] if argv is None else argv
+    messages = pd.read_csv(argv[0])['message'].tolist() if argv else []
+
+    mismatches = check(messages, verbose=True)
+    for name, n in mismatches.items():
+        print(f'{name:28s} {n} mismatches')
+
+    return 1 if any(mismatches.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
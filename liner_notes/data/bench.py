@@ -0,0 +1,178 @@
+"""Benchmarks for the data-cleaning pipeline
+
+Run and save results, then compare a later commit against them:
+
+    python -m liner_notes.data.bench --output before.json
+    python -m liner_notes.data.bench --baseline before.json --threshold 0.1
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from liner_notes.data import garagiste, stream, synthetic, utils, vectorized
+
+
+def best_of(func, repeat):
+    # best wall time of `repeat` runs, the least noisy estimate
+    elapsed = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed.append(time.perf_counter() - start)
+    return min(elapsed)
+
+
+def commit():
+    try:
+        out = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(__file__),
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def run(n=2000, repeat=3, seed=0, verbose=False):
+    """Time each stage of the cleaning pipeline on a synthetic corpus.
+
+    Parameters
+    ----------
+    n : int, default 2000
+        number of synthetic messages
+    repeat : int, default 3
+        best-of-n timing
+    seed : int, default 0
+        seed of the synthetic corpus
+    verbose : bool, default False
+        if True prints each timing to stdout
+
+    Returns
+    -------
+    results : dict
+        'meta' describing the run and 'timings' mapping each benchmark
+        to seconds for the whole corpus
+
+    """
+    df = synthetic.frame(n, seed=seed)
+    raw = df['message'].tolist()
+    # the helpers only ever see lower-cased ascii text
+    msgs = [m.lower().encode('ascii', 'ignore').decode() for m in raw]
+
+    benchmarks = {
+        'garagiste.get_label': lambda: [garagiste.get_label(m) for m in msgs],
+        'garagiste.clean_message': lambda: [garagiste.clean_message(m) for m in raw],
+        'engine.clean_message': lambda: [garagiste.ENGINE.clean_message(m) for m in raw],
+        'vectorized.clean_series': lambda: vectorized.clean_series(
+            df['message'], garagiste.ENGINE,
+        ),
+        'utils.trim_after': lambda: [
+            utils.trim_after(m, p) for m in msgs for p in garagiste.TRIM_AFTER
+        ],
+        'utils.trim_before': lambda: [
+            utils.trim_before(m, p) for m in msgs for p in garagiste.TRIM_BEFORE
+        ],
+        'utils.delete_lines_with_string': lambda: [
+            utils.delete_lines_with_string(m, garagiste.UNWANTED_LINES)
+            for m in msgs
+        ],
+        'utils.replace': lambda: [
+            utils.replace(m, garagiste.UNWANTED_ENTITIES) for m in msgs
+        ],
+    }
+
+    timings = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        infile = os.path.join(tmp, 'mail.csv')
+        outfile = os.path.join(tmp, 'clean.csv')
+        df.to_csv(infile, index=False)
+
+        benchmarks['garagiste.clean'] = lambda: garagiste.clean(infile, outfile)
+        benchmarks['stream.clean_csv'] = lambda: stream.clean_csv(infile, outfile)
+
+        for name, func in benchmarks.items():
+            timings[name] = best_of(func, repeat)
+            if verbose:
+                print(f'{name:32s} {timings[name]:8.4f}s')
+
+    return {
+        'meta': {
+            'commit': commit(),
+            'messages': n,
+            'repeat': repeat,
+            'seed': seed,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+        },
+        'timings': timings,
+    }
+
+
+def compare(current, baseline, threshold=0.1):
+    """Find benchmarks that got slower than baseline by more than threshold.
+
+    Parameters
+    ----------
+    current : dict
+        results of run()
+    baseline : dict
+        results of an earlier run()
+    threshold : float, default 0.1
+        allowed slowdown, 0.1 == 10%
+
+    Returns
+    -------
+    regressions : list
+        (name, baseline seconds, current seconds, ratio) tuples
+
+    """
+    regressions = []
+
+    for name, seconds in current['timings'].items():
+        before = baseline['timings'].get(name)
+        if not before:
+            continue
+        ratio = seconds / before
+        if ratio > 1 + threshold:
+            regressions.append((name, before, seconds, ratio))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results as JSON')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    results = run(args.messages, args.repeat, args.seed, verbose=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for name, before, after, ratio in regressions:
+            print(f'REGRESSION {name}: {before:.4f}s -> {after:.4f}s ({ratio:.2f}x)')
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
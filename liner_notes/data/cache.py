@@ -0,0 +1,143 @@
+"""Persistent cache of cleaned messages -- SQLite on disk"""
+
+import hashlib
+import os
+import sqlite3
+
+
+class CleaningCache:
+    """Content-addressed store of (label, note) pairs.
+
+    Entries are keyed by a hash of the raw message together with a
+    fingerprint of the rule tables that produced them, so changing a
+    rule misses on every message cleaned under the old rules.
+
+    Parameters
+    ----------
+    path : string
+        path to the SQLite database, created if missing
+    fingerprint : string
+        version of the cleaning rules, see garagiste.fingerprint()
+
+    Example
+    -------
+    >>> with CleaningCache('clean_cache.sqlite', fingerprint()) as cache:
+    ...     pairs = cache.clean(messages, clean_messages)
+    >>> cache.hits, cache.misses
+    (120431, 17)
+
+    """
+
+    # SQLite's default limit on host parameters is 999
+    BATCH = 500
+
+    def __init__(self, path, fingerprint):
+        self.path = os.path.expanduser(path)
+        self.fingerprint = fingerprint
+        self.hits = 0
+        self.misses = 0
+
+        self.db = sqlite3.connect(self.path)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS cleaned ('
+            ' key BLOB PRIMARY KEY,'
+            ' fingerprint TEXT NOT NULL,'
+            ' label TEXT NOT NULL,'
+            ' note TEXT NOT NULL'
+            ')'
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def key(self, message):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(self.fingerprint.encode())
+        digest.update(b'\0')
+        digest.update(message.encode('utf-8', 'surrogatepass'))
+        return digest.digest()
+
+    def get(self, keys):
+        """Return {key: (label, note)} for the keys already cached."""
+        keys = list(keys)
+        found = {}
+
+        for i in range(0, len(keys), self.BATCH):
+            batch = keys[i:i + self.BATCH]
+            marks = ','.join('?' * len(batch))
+            rows = self.db.execute(
+                f'SELECT key, label, note FROM cleaned WHERE key IN ({marks})',
+                batch,
+            )
+            for key, label, note in rows:
+                found[key] = (label, note)
+
+        return found
+
+    def put(self, items):
+        """Store (key, (label, note)) items."""
+        self.db.executemany(
+            'INSERT OR REPLACE INTO cleaned VALUES (?, ?, ?, ?)',
+            ((key, self.fingerprint, label, note) for key, (label, note) in items),
+        )
+        self.db.commit()
+
+    def clean(self, messages, func):
+        """Clean messages, only running func on the ones not cached.
+
+        Parameters
+        ----------
+        messages : sequence
+            raw email bodies
+        func : callable
+            maps a list of messages to a list of (label, note) pairs,
+            e.g. garagiste.clean_messages
+
+        Returns
+        -------
+        out : list
+            (label, note) pairs in the same order as messages
+
+        """
+        messages = list(messages)
+        keys = [self.key(msg) for msg in messages]
+        found = self.get(set(keys))
+
+        todo = {}  # identical messages are only cleaned once
+        for key, msg in zip(keys, messages):
+            if key not in found:
+                todo.setdefault(key, msg)
+
+        if todo:
+            cleaned = dict(zip(todo, func(list(todo.values()))))
+            self.put(cleaned.items())
+            found.update(cleaned)
+
+        n_hits = sum(key not in todo for key in keys)
+        self.hits += n_hits
+        self.misses += len(keys) - n_hits
+
+        return [found[key] for key in keys]
+
+    def prune(self):
+        """Delete entries written under other fingerprints.
+
+        Returns
+        -------
+        n : int
+            number of entries deleted
+
+        """
+        n = self.db.execute(
+            'DELETE FROM cleaned WHERE fingerprint != ?',
+            (self.fingerprint,),
+        ).rowcount
+        self.db.commit()
+        return n
@@ -0,0 +1,300 @@
+"""Compiled cleaning engine -- garagiste.clean_message in fewer passes"""
+
+import html
+import re
+import time
+
+from liner_notes.data import utils
+
+
+BACKREFERENCE = re.compile(r'\\(\d|g<)')
+NON_ASCII = re.compile(r'[^\x00-\x7f]+')
+
+
+class Rule:
+    """A single compiled substitution.
+
+    Parameters
+    ----------
+    name : string
+        key of the pattern in the pattern table
+    regex : compiled regular expression
+    replacement : string
+        re.sub() style replacement template
+    count : int
+        maximum number of replacements, 0 replaces all
+    guards : sequence, default ()
+        literals the rule cannot match without -- the pass is skipped
+        when none of them occur in the input
+
+    """
+
+    def __init__(self, name, regex, replacement, count, guards=()):
+        self.name = name
+        self.regex = regex
+        self.replacement = replacement
+        self.count = count
+        self.guards = tuple(guards)
+
+    def __call__(self, s):
+        if self.guards and not any(g in s for g in self.guards):
+            return s
+        return self.regex.sub(self.replacement, s, self.count)
+
+    def subn(self, s):
+        # like __call__ but also returns the number of replacements
+        if self.guards and not any(g in s for g in self.guards):
+            return s, 0
+        return self.regex.subn(self.replacement, s, self.count)
+
+
+class Step:
+    """A text utility applied as a pipeline stage, func(s, *args)."""
+
+    def __init__(self, name, func, *args):
+        self.name = name
+        self.func = func
+        self.args = args
+
+    def __call__(self, s):
+        return self.func(s, *self.args)
+
+
+class FusedRule:
+    """Several Rules applied as one alternation with a dispatch callback.
+
+    Only valid for rules whose matches and look-arounds are unaffected
+    by each other's replacements, and whose patterns and replacements
+    carry no back-references (group numbers shift inside the
+    alternation).  Each rule keeps its own replacement count.
+
+    Parameters
+    ----------
+    rules : sequence
+        Rules to fuse, in pipeline order
+    triggers : string, default ''
+        characters every match of every rule starts with -- lets the
+        regex engine jump straight to candidate positions
+
+    """
+
+    def __init__(self, rules, triggers=''):
+        for rule in rules:
+            if (BACKREFERENCE.search(rule.regex.pattern)
+                    or BACKREFERENCE.search(rule.replacement)):
+                raise ValueError(f'cannot fuse {rule.name}: back-reference')
+
+        self.name = '+'.join(rule.name for rule in rules)
+        self.rules = {rule.name: rule for rule in rules}
+        alternation = '|'.join(
+            f'(?P<{rule.name}>{rule.regex.pattern})' for rule in rules
+        )
+        if triggers:
+            alternation = f'(?=[{re.escape(triggers)}])(?:{alternation})'
+        self.regex = re.compile(alternation, rules[0].regex.flags)
+        # the fused pass may be skipped only when every member may be
+        if all(rule.guards for rule in rules):
+            self.guards = tuple(g for rule in rules for g in rule.guards)
+        else:
+            self.guards = ()
+
+    def __call__(self, s):
+        if self.guards and not any(g in s for g in self.guards):
+            return s
+
+        remaining = {name: rule.count for name, rule in self.rules.items()}
+
+        def dispatch(match):
+            name = match.lastgroup
+            n = remaining[name]
+            if n == 0:  # unlimited
+                return self.rules[name].replacement
+            if n < 0:  # exhausted -- leave the match alone
+                return match.group()
+            remaining[name] = n - 1 if n > 1 else -1
+            return self.rules[name].replacement
+
+        return self.regex.sub(dispatch, s)
+
+
+class CleaningEngine:
+    """Compile the garagiste rule tables once and clean messages with them.
+
+    Produces exactly the same (label, note) pairs as
+    garagiste.clean_message, but compiles every pattern up front, skips
+    passes whose guard literals are absent and fuses compatible runs of
+    substitutions into a single pass.
+
+    Parameters
+    ----------
+    patterns : dict
+        pattern name -> regular expression string
+    translation : dict
+        str.translate() table applied before ascii encoding
+    label_substitutions : sequence
+        (name, replacement, count) applied to the extracted label
+    trim_after : sequence
+        markers passed to utils.trim_after, in order
+    trim_before : sequence
+        markers passed to utils.trim_before, in order
+    unwanted_lines : sequence
+        passed to utils.delete_lines_with_string
+    unwanted_entities : sequence
+        passed to utils.replace
+    substitutions : sequence
+        (name, replacement, count) applied to the message, in order
+    guards : dict, default None
+        pattern name -> literals the pattern cannot match without
+    fused : sequence, default ()
+        (names, triggers) pairs -- a tuple of consecutive substitution
+        names to apply in one pass and the characters their matches
+        start with (see FusedRule)
+    flags : dict, default None
+        pattern name -> re flags it is compiled with, 0 when missing
+
+    Example
+    -------
+    >>> from liner_notes.data import garagiste
+    >>> garagiste.ENGINE.clean_message('2009 Charvin - $58.81\nWow! thank you')
+    ('2009 charvin', '2009 charvin 58.81 usd wow')
+
+    """
+
+    def __init__(self, patterns, translation, label_substitutions,
+                 trim_after, trim_before, unwanted_lines, unwanted_entities,
+                 substitutions, guards=None, fused=(), flags=None):
+        guards = guards or {}
+        flags = flags or {}
+        compiled = {
+            name: re.compile(pattern, flags.get(name, 0))
+            for name, pattern in patterns.items()
+        }
+
+        def build(name, replacement, count):
+            return Rule(name, compiled[name], replacement, count,
+                        guards.get(name, ()))
+
+        self.label = compiled['LABEL']
+        self.label_rules = [build(*sub) for sub in label_substitutions]
+        self.translation = translation
+        self.steps = (
+            [Step(f'trim_after:{p}', utils.trim_after, p) for p in trim_after]
+            + [Step(f'trim_before:{p}', utils.trim_before, p) for p in trim_before]
+            + [
+                Step('delete_lines_with_string', utils.delete_lines_with_string,
+                     list(unwanted_lines)),
+                Step('replace', utils.replace, list(unwanted_entities)),
+            ]
+        )
+        self.rules = self._fuse([build(*sub) for sub in substitutions], fused)
+
+    @staticmethod
+    def _fuse(rules, fused):
+        names = [rule.name for rule in rules]
+
+        for group, triggers in fused:
+            start = names.index(group[0])
+            stop = start + len(group)
+            if tuple(names[start:stop]) != tuple(group):
+                raise ValueError(f'cannot fuse {group}: not consecutive')
+            rules[start:stop] = [FusedRule(rules[start:stop], triggers)]
+            names[start:stop] = [rules[start].name]
+
+        return rules
+
+    def _to_ascii(self, match):
+        msg = match.group().translate(self.translation)
+        return msg.encode('ascii', 'ignore').decode()
+
+    def get_label(self, s):
+        # expects the lower-cased, ascii message
+        result = self.label.search(s)
+        msg = result.group(1) if result else 'empty'
+
+        for rule in self.label_rules:
+            msg = rule(msg)
+
+        return msg
+
+    def clean_message(self, s):
+        msg = s.lower()
+        msg = html.unescape(msg)
+        # translate only the non-ascii runs, str.translate is slow on
+        # long strings once they contain a single non-ascii character
+        msg = NON_ASCII.sub(self._to_ascii, msg)
+
+        label = self.get_label(msg)
+
+        for step in self.steps:
+            msg = step(msg)
+
+        for rule in self.rules:
+            msg = rule(msg)
+
+        note = ' '.join(msg.split())  # normalize whitespace
+
+        return label, note
+
+
+def benchmark(messages, repeat=3, verbose=True):
+    """Time garagiste.clean_message against garagiste.ENGINE on a corpus
+    and check both give the output of the baseline pipeline.
+
+    Parameters
+    ----------
+    messages : sequence
+        raw email bodies
+    repeat : int, default 3
+        best-of-n timing
+    verbose : bool, default True
+        if True prints the timings to stdout
+
+    Returns
+    -------
+    out : dict
+        seconds for each implementation and the speedup
+
+    """
+    from liner_notes.data import baseline, garagiste
+
+    def best(func):
+        elapsed = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            out = [func(msg) for msg in messages]
+            elapsed.append(time.perf_counter() - start)
+        return min(elapsed), out
+
+    reference, expected = best(garagiste.clean_message)
+    compiled, actual = best(garagiste.ENGINE.clean_message)
+
+    # the reference is checked too, against the frozen original pipeline
+    frozen = [baseline.clean_message(msg) for msg in messages]
+    for name, out in [('reference', expected), ('engine', actual)]:
+        mismatches = sum(a != e for a, e in zip(out, frozen))
+        if mismatches:
+            raise AssertionError(f'{mismatches} messages differ from the baseline in {name}')
+
+    out = {
+        'messages': len(messages),
+        'reference': reference,
+        'engine': compiled,
+        'speedup': reference / compiled if compiled else float('inf'),
+    }
+
+    if verbose:
+        print(f"messages:  {out['messages']}")
+        print(f"reference: {out['reference']:.3f}s")
+        print(f"engine:    {out['engine']:.3f}s")
+        print(f"speedup:   {out['speedup']:.2f}x")
+
+    return out
+
+
+if __name__ == '__main__':
+    import sys
+
+    import pandas as pd
+
+    infile = sys.argv[1] if len(sys.argv) > 1 else 'garagiste_wine.csv'
+    benchmark(pd.read_csv(infile)['message'].tolist())
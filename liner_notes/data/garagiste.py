@@ -1,11 +1,19 @@
 """Simple email cleanup -- wine reviews stored in a CSV file"""
 
+import functools
+import hashlib
 import html
+import json
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
 
 import pandas as pd
+import pyarrow as pa
 
-from liner_notes.data import utils
+from liner_notes.data import dedup, engine, instrument, utils, vectorized
+from liner_notes.data.cache import CleaningCache
+from liner_notes.data.ingest import IngestState
 
 
 PATTERNS = {
@@ -57,26 +65,60 @@ PATTERNS = {
 }
 
 
-def resub(name, s, replacement=''):
-    # always ignore case and default to deleting the match
-    return re.sub(PATTERNS[name], replacement, s, re.IGNORECASE)
+# regex flags per pattern -- only the LABEL search ever really ignored
+# case, see RESUB_COUNT
+FLAGS = {
+    'LABEL': re.IGNORECASE,
+}
+
+# compile the table once
+COMPILED = {
+    name: re.compile(pattern, FLAGS.get(name, 0))
+    for name, pattern in PATTERNS.items()
+}
+
+# resub() used to hand re.IGNORECASE to re.sub() positionally, which
+# re.sub() reads as `count` -- so every rule has only ever replaced its
+# first two matches, and none of them ignored case.  Kept as-is so
+# cleaned output does not change.
+RESUB_COUNT = int(re.IGNORECASE)
+
+# (pattern name, replacement, count) applied to the label, in order
+LABEL_SUBSTITUTIONS = [
+    ('FORMAT', '', RESUB_COUNT),
+    ('QUANTITY', '', RESUB_COUNT),
+    ('SYMBOL', '', 0),
+]
+
+
+def resub(name, s, replacement='', count=RESUB_COUNT):
+    # default to deleting the match
+    return COMPILED[name].sub(replacement, s, count)
 
 
 def get_label(s):
     # Extract the wine 'label' from the string
-    result = re.search(PATTERNS['LABEL'], s, re.IGNORECASE)
+    result = COMPILED['LABEL'].search(s)
     msg = result.group(1) if result else 'empty'
 
-    msg = resub('FORMAT', msg)
-    msg = resub('QUANTITY', msg)
-
-    # re.IGNORECASE breaks this one for someone
-    # msg = resub('SYMBOL', msg)
-    msg = re.sub(PATTERNS['SYMBOL'], '', msg)
+    for name, replacement, count in LABEL_SUBSTITUTIONS:
+        msg = resub(name, msg, replacement, count)
 
     return msg
 
 
+def normalize_label(s):
+    # a bare label in the form get_label() leaves it, e.g. for lookups --
+    # the same lower, unescape and to-ascii prefix as clean_message first
+    msg = html.unescape(s.lower())
+    msg = engine.NON_ASCII.sub(ENGINE._to_ascii, msg)
+
+    for name, replacement, count in LABEL_SUBSTITUTIONS:
+        msg = resub(name, msg, replacement, count)
+
+    return ' '.join(msg.split())
+
+
 # WTH? -- someone please show me a better way to do this!
 UNICODE_TO_ASCII = {
     u'\u02c8': "'",
@@ -114,8 +156,98 @@ TRANSLATION = str.maketrans(
 #
 
 
+# email boilerplate -- keep text after/before these markers
+TRIM_AFTER = ['dear friends']
+TRIM_BEFORE = ['thank you', 'to order']
+
+UNWANTED_LINES = [
+    '/person',
+    'finest and freshest original provenance available',
+    'first come first served',
+    'jon rimmerman',
+    'parcel has arrived',
+    'parcel has just arrived',
+    'parcel is set to arrive',
+    'shipment only',
+    'wholesalers',
+]
+
+UNWANTED_ENTITIES = [
+    'antonio galloni',
+    'gary walsh',
+    'james halliday',
+    'neal martin',
+    'nick stock',
+
+    'jancis robinson',
+    'jancis',
+
+    'jon rimmerman',
+    'rimmerman',
+
+    'robert parker',
+    'bob parker',
+    'parker',
+
+    'the wine front',
+    'wine advocate',
+    'wine spectator',
+]
+
+# (pattern name, replacement, count) applied to the message, in order
+SUBSTITUTIONS = [
+    ('POINTS', 'amazing', RESUB_COUNT),
+    ('PRICE', r'\2 usd', RESUB_COUNT),
+    ('QUANTITY', '', RESUB_COUNT),
+    ('SCORE', '', RESUB_COUNT),
+    ('URL', '', RESUB_COUNT),
+
+    ('AMPERSAND', ' and ', RESUB_COUNT),
+    ('DASH', ' to ', RESUB_COUNT),
+    ('ELLIPSIS', ' ', RESUB_COUNT),
+    ('ENDASH', '', RESUB_COUNT),
+    ('EXCLAIM', '.', RESUB_COUNT),
+    ('PERCENT', ' percent', RESUB_COUNT),
+    ('POUND', ' number ', RESUB_COUNT),
+    ('SLASH', ' and ', RESUB_COUNT),
+
+    ('SYMBOL', '', 0),
+    ('RUN_ON', '', RESUB_COUNT),
+]
+
+# literals a rule cannot match without -- lets the engine skip a whole
+# pass with a cheap substring test (checked against lower-cased text)
+GUARDS = {
+    'AMPERSAND': ('&',),
+    'DASH': ('-',),
+    'ELLIPSIS': ('..',),
+    'ENDASH': ('-',),
+    'EXCLAIM': ('!',),
+    'FORMAT': ('ml', 'lt'),
+    'PERCENT': ('%',),
+    'POINTS': ('pts',),
+    'POUND': ('#',),
+    'PRICE': ('$',),
+    'QUANTITY': ('x',),
+    'SLASH': ('/',),
+    'URL': ('://',),
+}
+
+# runs of SUBSTITUTIONS the engine may apply in a single pass, and the
+# characters their matches start with.  Only safe when the rules trigger
+# on different characters and neither their replacements nor their
+# look-arounds can see each other's edits: '!' -> '.', '%' -> ' percent'
+# and '#' -> ' number ' qualify.
+FUSED = [
+    (('EXCLAIM', 'PERCENT', 'POUND'), '!%#'),
+]
+
+
 def clean_message(s):
     # process the string generating a clean message
+    #
+    # reference implementation, one rule per pass -- clean() uses the
+    # compiled ENGINE below which produces identical output
     msg = s.lower()
     msg = html.unescape(msg)
     msg = msg.translate(TRANSLATION)
@@ -130,70 +262,57 @@ def clean_message(s):
 
     label = get_label(msg)
 
-    msg = utils.trim_after(msg, 'dear friends')
-    msg = utils.trim_before(msg, 'thank you')
-    msg = utils.trim_before(msg, 'to order')
-
-    unwanted_lines = [
-        '/person',
-        'finest and freshest original provenance available',
-        'first come first served',
-        'jon rimmerman',
-        'parcel has arrived',
-        'parcel has just arrived',
-        'parcel is set to arrive',
-        'shipment only',
-        'wholesalers',
-    ]
-    msg = utils.delete_lines_with_string(msg, unwanted_lines)
+    for pattern in TRIM_AFTER:
+        msg = utils.trim_after(msg, pattern)
+    for pattern in TRIM_BEFORE:
+        msg = utils.trim_before(msg, pattern)
 
-    unwanted_entities = [
-        'antonio galloni',
-        'gary walsh',
-        'james halliday',
-        'neal martin',
-        'nick stock',
+    msg = utils.delete_lines_with_string(msg, UNWANTED_LINES)
+    msg = utils.replace(msg, UNWANTED_ENTITIES)
 
-        'jancis robinson',
-        'jancis',
+    for name, replacement, count in SUBSTITUTIONS:
+        msg = resub(name, msg, replacement, count)
 
-        'jon rimmerman',
-        'rimmerman',
-
-        'robert parker',
-        'bob parker',
-        'parker',
+    note = ' '.join(msg.split())  # normalize whitespace
 
-        'the wine front',
-        'wine advocate',
-        'wine spectator',
-    ]
-    msg = utils.replace(msg, unwanted_entities)
+    return label, note
 
-    msg = resub('POINTS', msg, 'amazing')
-    msg = resub('PRICE', msg, r'\2 usd')
-    msg = resub('QUANTITY', msg)
-    msg = resub('SCORE', msg)
-    msg = resub('URL', msg)
 
-    msg = resub('AMPERSAND', msg, ' and ')
-    msg = resub('DASH', msg, ' to ')
-    msg = resub('ELLIPSIS', msg, ' ')
-    msg = resub('ENDASH', msg)
-    msg = resub('EXCLAIM', msg, '.')
-    msg = resub('PERCENT', msg, ' percent')
-    msg = resub('POUND', msg, ' number ')
-    msg = resub('SLASH', msg, ' and ')
+def build_engine(cls=engine.CleaningEngine, **kwargs):
+    # an engine of class `cls` loaded with the rule tables above
+    return cls(
+        patterns=PATTERNS,
+        translation=TRANSLATION,
+        label_substitutions=LABEL_SUBSTITUTIONS,
+        trim_after=TRIM_AFTER,
+        trim_before=TRIM_BEFORE,
+        unwanted_lines=UNWANTED_LINES,
+        unwanted_entities=UNWANTED_ENTITIES,
+        substitutions=SUBSTITUTIONS,
+        guards=GUARDS,
+        fused=FUSED,
+        flags=FLAGS,
+        **kwargs,
+    )
 
-    # re.IGNORECASE breaks this one for someone
-    # msg = resub('SYMBOL', msg)
-    msg = re.sub(PATTERNS['SYMBOL'], '', msg)
 
-    msg = resub('RUN_ON', msg, '')
+ENGINE = build_engine()
 
-    note = ' '.join(msg.split())  # normalize whitespace
 
-    return label, note
+def fingerprint():
+    # version of every rule table that affects the cleaned output
+    tables = [
+        PATTERNS,
+        {name: int(flags) for name, flags in FLAGS.items()},
+        UNICODE_TO_ASCII,
+        LABEL_SUBSTITUTIONS,
+        TRIM_AFTER,
+        TRIM_BEFORE,
+        UNWANTED_LINES,
+        UNWANTED_ENTITIES,
+        SUBSTITUTIONS,
+    ]
+    return hashlib.sha256(json.dumps(tables).encode()).hexdigest()
 
 
 def test():
@@ -289,7 +408,71 @@ def test():
     print(f'{s}\n{out}\n')
 
 
-def clean(infile, outfile=None, verbose=False):
+def _clean_chunk(messages):
+    # module level so worker processes can unpickle it
+    return [ENGINE.clean_message(msg) for msg in messages]
+
+
+def clean_messages(messages, workers=1, chunksize=1000):
+    """Clean raw email messages, optionally on a process pool.
+
+    Parameters
+    ----------
+    messages : sequence
+        raw email bodies
+    workers : int, default 1
+        number of worker processes, None uses every core
+    chunksize : int, default 1000
+        messages handed to a worker at a time
+
+    Returns
+    -------
+    out : list
+        (label, note) pairs in the same order as messages
+
+    """
+    messages = list(messages)
+
+    if workers == 1 or len(messages) <= chunksize:
+        return _clean_chunk(messages)
+
+    chunks = [
+        messages[i:i + chunksize]
+        for i in range(0, len(messages), chunksize)
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # map() yields results in submission order
+        return [pair for chunk in pool.map(_clean_chunk, chunks) for pair in chunk]
+
+
+def save(df, outfile):
+    """Write a dataframe to disk, format chosen by file extension.
+
+    '.arrow' writes an uncompressed Arrow IPC stream, the layout
+    datasets.Dataset.from_file memory-maps without copying or parsing.
+    '.parquet' writes Parquet, anything else CSV.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+    outfile : string
+        path to output file
+
+    """
+    if outfile.endswith('.arrow'):
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        with pa.OSFile(os.path.expanduser(outfile), 'wb') as sink:
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+    elif outfile.endswith('.parquet'):
+        df.to_parquet(outfile, index=False)
+    else:
+        df.to_csv(outfile, index=False)
+
+
+def clean(infile, outfile=None, verbose=False, workers=1, chunksize=1000,
+          cache=None, profile=None, backend='engine', near_duplicates=None,
+          state=None):
     """Read CSV file, clean the data, and return a
     pandas dataframe.  Can also, write data to disk.
 
@@ -298,14 +481,39 @@ def clean(infile, outfile=None, verbose=False):
     infile : string
         path to input CSV file
     outfile : string, default None
-        path to output CSV file
+        path to output CSV file, or '.arrow' / '.parquet' file (see save)
     verbose : bool, default False
         if True prints processing details to stdout
+    workers : int, default 1
+        number of processes cleaning messages, None uses every core
+    chunksize : int, default 1000
+        messages handed to a worker process at a time
+    cache : string, default None
+        path to a SQLite cache of cleaned messages -- only messages
+        not cleaned before under the current rules are processed
+    profile : string, default None
+        path to a JSON report of time, calls and matches for every rule
+        and text utility (see instrument.Profiler) -- profiling cleans
+        in this process, ignoring workers
+    backend : {'engine', 'vectorized'}, default 'engine'
+        'engine' cleans message by message (see workers), 'vectorized'
+        applies each stage to the whole message column at once with
+        pandas str methods (see vectorized.clean_series)
+    near_duplicates : float, default None
+        if given, also drop notes whose MinHash-estimated Jaccard
+        similarity to an earlier note is at least this (see dedup) --
+        with state, only among the rows of this run
+    state : string, default None
+        path to a SQLite watermark and key index of outfile (see
+        ingest.IngestState) -- only messages dated on or after the last
+        run are cleaned, and rows not already in outfile are appended to
+        it.  outfile must be a CSV file.
 
     Return
     ------
     df_clean : pandas.DataFrame
-        cleaned data with columns = ['labels', 'notes']
+        cleaned data with columns = ['labels', 'notes'] -- with state,
+        only the rows appended by this run
 
     Example
     -------
@@ -315,24 +523,62 @@ def clean(infile, outfile=None, verbose=False):
     ...    verbose=True,
     ... )
 
+    daily, cleaning only the new mail:
+
+    >>> df_new = clean(
+    ...    infile='garagiste_wine.csv',
+    ...    outfile='garagise_wine_clean.csv',
+    ...    state='garagiste_ingest.sqlite',
+    ... )
+
     """
     if verbose:
         test()
         input('Hit ENTER to continue...')
 
-    df = pd.read_csv(infile)
-    labels, notes = [], []
-
-    for _, row in df.iterrows():
-        label, note = clean_message(row.message)
-        labels.append(label)
-        notes.append(note)
-
-        if verbose:  # helps debugging
+    if state:
+        if not outfile or outfile.endswith(('.arrow', '.parquet')):
+            raise ValueError('incremental cleaning appends to a CSV outfile')
+        ingest = IngestState(state, fingerprint(), outfile)
+        df = ingest.read(infile)
+    else:
+        df = pd.read_csv(infile)
+
+    if backend not in ('engine', 'vectorized'):
+        raise ValueError(f'unknown backend: {backend}')
+
+    func = functools.partial(clean_messages, workers=workers, chunksize=chunksize)
+
+    if backend == 'vectorized':
+        def func(messages):
+            labels, notes = vectorized.clean_series(pd.Series(messages), ENGINE)
+            return list(zip(labels, notes))
+
+    if profile:
+        profiler = instrument.Profiler()
+        profiled = build_engine(instrument.ProfiledEngine, profiler=profiler)
+
+        def func(messages):
+            return [profiled.clean_message(msg) for msg in messages]
+
+    if cache:
+        with CleaningCache(cache, fingerprint()) as store:
+            store.prune()  # entries from older rules never hit again
+            pairs = store.clean(df['message'], func)
+        if verbose:
+            print(f'cache hits: {store.hits}  misses: {store.misses}')
+    else:
+        pairs = func(df['message'])
+    labels = [label for label, _ in pairs]
+    notes = [note for _, note in pairs]
+
+    if verbose:  # helps debugging
+        rows = zip(df['date'], df['message'], labels, notes)
+        for date, message, label, note in rows:
             if label == 'empty':
                 # perhaps discover why label was empty
-                print(f'date:  {row.date}')
-                print(row.message)
+                print(f'date:  {date}')
+                print(message)
                 print('-' * 45)
             else:
                 # show labels and notes with chunky line breaks
@@ -356,12 +602,30 @@ def clean(infile, outfile=None, verbose=False):
         .reset_index(drop=True)
     )
 
+    if near_duplicates:
+        n_exact = len(df_clean)
+        df_clean = dedup.drop_near_duplicates(df_clean, threshold=near_duplicates)
+        if verbose:
+            print(f'near-duplicates dropped: {n_exact - len(df_clean)}')
+
+    if state:
+        df_clean = ingest.append(df_clean, df['date'])
+        if verbose:
+            print(f'messages read: {len(df)}  rows appended: {len(df_clean)}  '
+                  f'watermark: {ingest.watermark}')
+        ingest.close()
+    elif outfile:
+        save(df_clean, outfile)
+
     if verbose:
         df_clean.info()
-        print(df_clean.sample(5))
+        print(df_clean.sample(min(5, len(df_clean))))
 
-    if outfile:
-        df_clean.to_csv(outfile, index=False)
+    if profile:
+        profiler.dump(profile)
+        if verbose:
+            for name, stat in list(profiler.report()['stages'].items())[:10]:
+                print(f"{name:32s} {stat['seconds']:8.3f}s {stat['matches']:8d} matches")
 
     return df_clean
 
@@ -369,6 +633,6 @@ def clean(infile, outfile=None, verbose=False):
 if __name__ == '__main__':
     clean(
         infile='~/PycharmProjects/gtc/garagiste_wine.csv',
-        outfile='garagiste_wine_clean.csv',
+        outfile='garagiste_wine_clean.arrow',
         verbose=True,
     )
@@ -0,0 +1,188 @@
+"""Incremental ingestion -- date watermark and key index of a cleaned CSV"""
+
+import os
+import sqlite3
+
+import pandas as pd
+
+from liner_notes.data.keys import key
+
+
+class IngestState:
+    """What has already been cleaned into outfile, kept in SQLite.
+
+    Holds the latest message date processed, the size of outfile after
+    the last committed append and a 128-bit key (see keys.key) for
+    every (name, note) row written.  A run reads only messages dated on
+    or after the watermark, drops rows whose key is already indexed and
+    appends the rest.
+
+    The append is committed by recording outfile's new size together
+    with the keys and watermark in one transaction.  Anything past the
+    recorded size is an append that never committed and is truncated
+    when the state is opened, so a crash at any point leaves outfile and
+    the index in agreement.
+
+    Starts over (empty index, outfile rewritten) when the cleaning rules
+    changed or outfile is missing or shorter than recorded.
+
+    Parameters
+    ----------
+    path : string
+        path to the SQLite database, created if missing
+    fingerprint : string
+        version of the cleaning rules, see garagiste.fingerprint()
+    outfile : string
+        path to the cleaned CSV file being appended to
+
+    Example
+    -------
+    >>> with IngestState('ingest.sqlite', fingerprint(), 'clean.csv') as state:
+    ...     df = state.read('garagiste_wine.csv')
+    ...     ...  # clean df into df_clean
+    ...     df_new = state.append(df_clean, df['date'])
+
+    """
+
+    # SQLite's default limit on host parameters is 999
+    BATCH = 500
+
+    def __init__(self, path, fingerprint, outfile):
+        self.path = os.path.expanduser(path)
+        self.outfile = os.path.expanduser(outfile)
+
+        self.db = sqlite3.connect(self.path)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS meta ('
+            ' name TEXT PRIMARY KEY,'
+            ' value TEXT NOT NULL'
+            ')'
+        )
+        self.db.execute('CREATE TABLE IF NOT EXISTS rows (key BLOB PRIMARY KEY)')
+
+        size = os.path.getsize(self.outfile) if os.path.exists(self.outfile) else None
+        if (self.meta('fingerprint') != fingerprint
+                or size is None or size < int(self.meta('bytes', 0))):
+            self.reset(fingerprint)
+        elif size > int(self.meta('bytes')):
+            # drop an append that was written but never committed
+            with open(self.outfile, 'r+b') as f:
+                f.truncate(int(self.meta('bytes')))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def meta(self, name, default=None):
+        row = self.db.execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else default
+
+    def reset(self, fingerprint):
+        with self.db:
+            self.db.execute('DELETE FROM rows')
+            self.db.execute('DELETE FROM meta')
+            self.db.execute("INSERT INTO meta VALUES ('fingerprint', ?)", (fingerprint,))
+            self.db.execute("INSERT INTO meta VALUES ('bytes', '0')")
+
+    @property
+    def watermark(self):
+        """Latest message date processed, None before the first run."""
+        value = self.meta('watermark')
+        return pd.Timestamp(value) if value else None
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM rows').fetchone()[0]
+
+    def read(self, infile, chunksize=10000):
+        """Messages of infile dated on or after the watermark.
+
+        The watermark day itself is read again, since mail can arrive
+        later on the same day -- rows cleaned before are dropped by
+        append().  Messages with an unreadable date are always read.
+
+        Returns
+        -------
+        df : pandas.DataFrame
+            the date and message columns of the selected rows
+
+        """
+        watermark = self.watermark
+        if watermark is None:
+            return pd.read_csv(infile)
+
+        # from the start of the watermark day, not the watermark itself
+        start = watermark.normalize()
+
+        chunks = []
+        for df in pd.read_csv(infile, chunksize=chunksize):
+            dates = pd.to_datetime(df['date'], errors='coerce')
+            chunks.append(df.loc[(dates >= start) | dates.isna()])
+
+        return pd.concat(chunks, ignore_index=True)
+
+    def seen(self, keys):
+        """Return the subset of keys already in the index."""
+        keys = list(keys)
+        found = set()
+
+        for i in range(0, len(keys), self.BATCH):
+            batch = keys[i:i + self.BATCH]
+            marks = ','.join('?' * len(batch))
+            rows = self.db.execute(f'SELECT key FROM rows WHERE key IN ({marks})', batch)
+            found.update(k for k, in rows)
+
+        return found
+
+    def append(self, df, dates):
+        """Append the rows of df not written before, then commit.
+
+        Parameters
+        ----------
+        df : pandas.DataFrame
+            cleaned rows with columns = ['name', 'note']
+        dates : sequence
+            dates of every message read, advancing the watermark
+
+        Returns
+        -------
+        df_new : pandas.DataFrame
+            the rows actually appended
+
+        """
+        keys = [
+            key(name, note).to_bytes(16, 'little')
+            for name, note in zip(df['name'], df['note'])
+        ]
+        seen = self.seen(keys)
+        df_new = df.loc[[k not in seen for k in keys]].reset_index(drop=True)
+        keys = [k for k in keys if k not in seen]
+
+        size = int(self.meta('bytes'))
+        with open(self.outfile, 'a' if size else 'w', newline='') as f:
+            df_new.to_csv(f, header=not size, index=False)
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+
+        latest = pd.to_datetime(pd.Series(dates), errors='coerce').max()
+        watermark = self.watermark
+        if pd.notna(latest) and (watermark is None or latest > watermark):
+            watermark = latest
+
+        # one transaction -- the append counts only once this commits
+        with self.db:
+            self.db.executemany('INSERT OR IGNORE INTO rows VALUES (?)', ((k,) for k in keys))
+            self.db.execute("UPDATE meta SET value = ? WHERE name = 'bytes'", (str(size),))
+            if watermark is not None:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('watermark', ?)",
+                    (watermark.isoformat(),),
+                )
+
+        return df_new
@@ -0,0 +1,151 @@
+"""Opt-in per-rule profiling of the cleaning engine"""
+
+import hashlib
+import json
+import time
+
+from liner_notes.data.engine import CleaningEngine
+
+
+class Profiler:
+    """Wall time, call count and match count for each pipeline stage.
+
+    For every stage the slowest call is kept together with the start of
+    the raw message being cleaned at the time, which is usually enough
+    to find an input that makes a rule backtrack badly.
+
+    Parameters
+    ----------
+    sample : int, default 200
+        characters of the slowest message kept per stage
+
+    """
+
+    def __init__(self, sample=200):
+        self.sample = sample
+        self.stats = {}
+        self.messages = 0
+        self.message = None  # raw message currently being cleaned
+
+    def start(self, message):
+        self.messages += 1
+        self.message = message
+
+    def record(self, name, seconds, matches):
+        stat = self.stats.get(name)
+        if stat is None:
+            stat = self.stats[name] = {
+                'calls': 0,
+                'seconds': 0.0,
+                'matches': 0,
+                'worst_seconds': 0.0,
+                'worst_message': None,
+                'worst_message_sha1': None,
+            }
+
+        stat['calls'] += 1
+        stat['seconds'] += seconds
+        stat['matches'] += matches
+
+        if seconds > stat['worst_seconds']:
+            stat['worst_seconds'] = seconds
+            if self.message is not None:
+                stat['worst_message'] = self.message[:self.sample]
+                stat['worst_message_sha1'] = hashlib.sha1(
+                    self.message.encode('utf-8', 'surrogatepass')
+                ).hexdigest()
+
+    def report(self):
+        """Stages sorted by total time, slowest first."""
+        stages = sorted(
+            self.stats.items(),
+            key=lambda item: item[1]['seconds'],
+            reverse=True,
+        )
+        return {
+            'messages': self.messages,
+            'seconds': sum(stat['seconds'] for _, stat in stages),
+            'stages': dict(stages),
+        }
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+
+class Profiled:
+    """Wrap a pipeline stage so each call is recorded by a Profiler.
+
+    Rules count the replacements they make, any other stage counts a
+    match when it changed the message.
+
+    """
+
+    def __init__(self, stage, profiler):
+        self.stage = stage
+        self.name = stage.name
+        self.profiler = profiler
+
+    def __call__(self, s):
+        subn = getattr(self.stage, 'subn', None)
+
+        start = time.perf_counter()
+        if subn is None:
+            out = self.stage(s)
+            matches = int(out != s)
+        else:
+            out, matches = subn(s)
+        self.profiler.record(self.name, time.perf_counter() - start, matches)
+
+        return out
+
+
+class ProfiledSearch:
+    """Wrap a compiled pattern's search() for a Profiler."""
+
+    def __init__(self, name, regex, profiler):
+        self.name = name
+        self.regex = regex
+        self.profiler = profiler
+
+    def search(self, s):
+        start = time.perf_counter()
+        result = self.regex.search(s)
+        self.profiler.record(self.name, time.perf_counter() - start, int(bool(result)))
+        return result
+
+
+class ProfiledEngine(CleaningEngine):
+    """CleaningEngine that reports every stage to a Profiler.
+
+    Takes the same parameters as CleaningEngine plus `profiler`.  Rules
+    are never fused here so each PATTERNS entry is timed on its own; the
+    output is unchanged.  The plain engine carries none of this, so
+    profiling costs nothing unless this class is used.
+
+    Example
+    -------
+    >>> profiler = Profiler()
+    >>> engine = garagiste.build_engine(ProfiledEngine, profiler=profiler)
+    >>> pairs = [engine.clean_message(msg) for msg in messages]
+    >>> profiler.dump('profile.json')
+
+    """
+
+    def __init__(self, *args, profiler, **kwargs):
+        kwargs['fused'] = ()
+        super().__init__(*args, **kwargs)
+
+        self.profiler = profiler
+        self.label = ProfiledSearch('LABEL', self.label, profiler)
+        self.label_rules = [
+            Profiled(rule, profiler) for rule in self.label_rules
+        ]
+        for rule in self.label_rules:
+            rule.name = f'label:{rule.name}'
+        self.steps = [Profiled(step, profiler) for step in self.steps]
+        self.rules = [Profiled(rule, profiler) for rule in self.rules]
+
+    def clean_message(self, s):
+        self.profiler.start(s)
+        return super().clean_message(s)
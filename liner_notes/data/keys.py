@@ -0,0 +1,12 @@
+"""Compact keys used to deduplicate cleaned (name, note) rows"""
+
+import hashlib
+
+
+def key(name, note):
+    """Compact 128-bit key used to deduplicate (name, note) pairs."""
+    digest = hashlib.blake2b(
+        f'{name}\0{note}'.encode(),
+        digest_size=16,
+    ).digest()
+    return int.from_bytes(digest, 'little')
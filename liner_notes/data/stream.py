@@ -0,0 +1,136 @@
+"""Bounded-memory cleaning of very large email CSV files"""
+
+import csv
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from liner_notes.data import garagiste
+from liner_notes.data.keys import key
+
+
+def read_messages(infile, chunksize=10000):
+    """Yield lists of raw messages from a CSV file, chunksize at a time."""
+    reader = pd.read_csv(infile, usecols=['message'], chunksize=chunksize)
+    for df in reader:
+        yield df['message'].tolist()
+
+
+def clean_chunks(chunks, workers=1):
+    """Yield lists of (label, note) pairs for each chunk of messages.
+
+    With workers > 1 the chunks are cleaned on a process pool, keeping at
+    most two chunks per worker in flight so memory stays bounded.
+
+    """
+    if workers == 1:
+        for messages in chunks:
+            yield garagiste.clean_messages(messages)
+        return
+
+    window = 2 * (workers or os.cpu_count() or 1)
+    pending = deque()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for messages in chunks:
+            pending.append(pool.submit(garagiste.clean_messages, messages))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def unique(chunks, seen=None):
+    """Yield non-empty, first-seen (name, note) pairs.
+
+    Mirrors the empty-label filter and drop_duplicates() in
+    garagiste.clean, but remembers only a 128-bit hash per pair.
+
+    """
+    seen = set() if seen is None else seen
+
+    for pairs in chunks:
+        for name, note in pairs:
+            if name.startswith('empty'):
+                continue
+            k = key(name, note)
+            if k in seen:
+                continue
+            seen.add(k)
+            yield name, note
+
+
+def write_csv(rows, outfile):
+    """Write (name, note) rows to outfile as they arrive.
+
+    Returns
+    -------
+    n : int
+        number of rows written
+
+    """
+    n = 0
+
+    with open(os.path.expanduser(outfile), 'w', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(['name', 'note'])
+        for row in rows:
+            writer.writerow(row)
+            n += 1
+
+    return n
+
+
+def clean_csv(infile, outfile, chunksize=10000, workers=1, verbose=False):
+    """Stream infile through the cleaning pipeline into outfile.
+
+    Produces the same CSV as garagiste.clean(infile, outfile) while only
+    ever holding a few chunks of messages and one small hash per unique
+    row in memory.
+
+    Parameters
+    ----------
+    infile : string
+        path to input CSV file
+    outfile : string
+        path to output CSV file
+    chunksize : int, default 10000
+        rows read from infile at a time
+    workers : int, default 1
+        number of processes cleaning chunks, None uses every core
+    verbose : bool, default False
+        if True prints the number of rows written to stdout
+
+    Returns
+    -------
+    n : int
+        number of rows written
+
+    Example
+    -------
+    >>> n = clean_csv(
+    ...    infile='garagiste_wine.csv',
+    ...    outfile='garagiste_wine_clean.csv',
+    ...    workers=8,
+    ... )
+
+    """
+    chunks = read_messages(infile, chunksize=chunksize)
+    chunks = clean_chunks(chunks, workers=workers)
+    n = write_csv(unique(chunks), outfile)
+
+    if verbose:
+        print(f'wrote {n} rows to {outfile}')
+
+    return n
+
+
+if __name__ == '__main__':
+    clean_csv(
+        infile='~/PycharmProjects/gtc/garagiste_wine.csv',
+        outfile='garagiste_wine_clean.csv',
+        verbose=True,
+    )
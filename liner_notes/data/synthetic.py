@@ -0,0 +1,127 @@
+"""Synthetic Garagiste-style emails for benchmarks"""
+
+import random
+
+import pandas as pd
+
+
+PRODUCERS = [
+    'Charvin Chateauneuf-du-Pape',
+    'Chevillon Nuits-St-Georges Vieilles Vignes',
+    'Domaine de la Chanteleuserie Bourgueil Rosé',
+    'Domaine Ledogar “Carignan Blanc”',
+    'Château Lagrézette Cahors',
+    '#55 Mystery Chardonnay',
+    'Bodega Zorzal “Eggo Filoso” Pinot Noir',
+]
+REGIONS = ['Rhône', 'Burgundy', 'Loire', 'Aude', 'Cahors', 'Tupungato']
+FORMATS = ['750ml', '375ml', '1.5lt', '3lt']
+SCORES = ['WA92-94', 'IWC93-95', 'WS95+', 'JS96', 'WA100', 'NR']
+CRITICS = [
+    'Robert Parker', 'Neal Martin', 'Antonio Galloni', 'Jancis Robinson',
+    'the Wine Advocate', 'Wine Spectator', 'James Halliday',
+]
+BOILERPLATE = [
+    'First come first served - we expect this to sell out',
+    'This parcel has just arrived in our warehouse',
+    'Shipment only, no wholesalers please',
+    '2 bottle limit/person',
+    'Jon Rimmerman',
+]
+PROSE = (
+    'old vines planted on limestone and clay give a wine of real depth '
+    'with dark cherry, plum and garrigue on the nose followed by a '
+    'palate of fine tannins, bright acidity and a long mineral finish '
+    'this is a producer we have followed for years and the vintage '
+    'delivered ripe fruit with freshness so drink now or cellar it'
+).split()
+PUNCTUATION = [
+    '!', '!!', '...', '&', ' & ', '/', ' / ', '%', '#1', '-', ' - ',
+    '@@@@@', '*****', '(', ')', ':', ';', '“', '”', '’', '—', '–', '…',
+    '&amp;', '&eacute;', 'café', 'rosé', '°',
+]
+
+
+def label(rng):
+    vintage = rng.choice(['NV', str(rng.randint(1961, 2021))])
+    price = f'{rng.randint(9, 400)}.{rng.randint(0, 99):02d}'
+    return (
+        f'{vintage} {rng.choice(PRODUCERS)} {rng.choice(FORMATS)} '
+        f'({rng.choice(REGIONS)}) - ${price}\n({rng.choice(SCORES)})'
+    )
+
+
+def sentence(rng):
+    words = [rng.choice(PROSE) for _ in range(rng.randint(8, 30))]
+
+    for _ in range(rng.randint(0, 3)):
+        i = rng.randrange(len(words))
+        words[i] = rng.choice([
+            f'{rng.randint(88, 96)}-{rng.randint(96, 99)}pts',
+            f'{rng.randint(85, 100)}pts',
+            f'${rng.randint(10, 99)}-{rng.randint(100, 200)}+',
+            f'{rng.randint(2, 6)} x {rng.choice(FORMATS)}',
+            rng.choice(SCORES).lower(),
+            rng.choice(CRITICS),
+            rng.choice(PUNCTUATION),
+            f'{rng.randint(1, 9)}-{rng.randint(10, 20)}',
+        ])
+
+    return ' '.join(words).capitalize() + rng.choice(['.', '!', '...', '?'])
+
+
+def message(rng):
+    """One email: greeting, offer label, prose, boilerplate and sign-off."""
+    lines = [
+        rng.choice(['Dear Friends,', 'DEAR FRIENDS,', 'Hi all,']),
+        label(rng) if rng.random() > 0.05 else 'Important shipping update',
+    ]
+
+    for _ in range(rng.randint(3, 25)):
+        line = sentence(rng)
+        if rng.random() < 0.1:
+            line = rng.choice(BOILERPLATE)
+        if rng.random() < 0.05:
+            line += f' https://www.garagiste.com/{rng.randint(0, 10**6)}'
+        lines.append(line)
+
+    lines.append(rng.choice(['Thank you,', 'To order, reply to this email']))
+    lines.append('Jon Rimmerman')
+
+    return '\n'.join(lines)
+
+
+def messages(n, seed=0):
+    """List of n synthetic emails, reproducible for a given seed."""
+    rng = random.Random(seed)
+    return [message(rng) for _ in range(n)]
+
+
+def frame(n, seed=0, duplicates=0.05):
+    """DataFrame shaped like the mailbox export (date, message).
+
+    Parameters
+    ----------
+    n : int
+        number of rows
+    seed : int, default 0
+    duplicates : float, default 0.05
+        fraction of rows that repeat an earlier message
+
+    Returns
+    -------
+    df : pandas.DataFrame
+
+    """
+    rng = random.Random(seed)
+    rows = []
+
+    for i in range(n):
+        if rows and rng.random() < duplicates:
+            msg = rng.choice(rows)
+        else:
+            msg = message(rng)
+        rows.append(msg)
+
+    dates = pd.date_range('2010-01-01', periods=n, freq='6h')
+    return pd.DataFrame({'date': dates.strftime('%Y-%m-%d %H:%M'), 'message': rows})
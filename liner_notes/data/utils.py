@@ -1,5 +1,77 @@
 """Simple text manipulation utilities"""
 
+import functools
+import re
+
+
+def _trie_regex(node):
+    # alternation that follows the trie -- each character is tested once
+    # per position and greedy optionals prefer the longest pattern
+    branches = [
+        re.escape(char) + _trie_regex(child)
+        for char, child in sorted(node.items())
+        if char
+    ]
+    if not branches:
+        return ''
+
+    if len(branches) == 1:
+        body = branches[0]
+        if '' in node:
+            body = f'(?:{body})?'
+    else:
+        body = '(?:' + '|'.join(branches) + ')'
+        if '' in node:
+            body += '?'
+
+    return body
+
+
+class Automaton:
+    """Multi-pattern matcher for literal strings.
+
+    The patterns are loaded into a trie which is compiled to a single
+    regular expression, so one scan of a string finds occurrences of
+    every pattern no matter how many there are.  At each position the
+    longest pattern wins.
+
+    Parameters
+    ----------
+    patterns : sequence
+        non-empty strings to look for
+
+    Example
+    -------
+    >>> automaton = Automaton(['jancis', 'jancis robinson', 'parker'])
+    >>> automaton.search('says jancis robinson').group()
+    'jancis robinson'
+
+    """
+
+    def __init__(self, patterns):
+        self.patterns = tuple(dict.fromkeys(patterns))
+        if not self.patterns or '' in self.patterns:
+            raise ValueError('patterns must be non-empty strings')
+
+        root = {}
+        for pattern in self.patterns:
+            node = root
+            for char in pattern:
+                node = node.setdefault(char, {})
+            node[''] = {}  # marks the end of a pattern
+
+        self.regex = re.compile(_trie_regex(root))
+
+    def search(self, s, pos=0):
+        """First (leftmost, longest) match in s at or after pos, or None."""
+        return self.regex.search(s, pos)
+
+
+@functools.lru_cache(maxsize=64)
+def compile_patterns(patterns):
+    """Build (once) and return the Automaton for a tuple of patterns."""
+    return Automaton(patterns)
+
 
 def trim_after(s, pattern):
     """Trim input string starting pattern.  
@@ -87,11 +159,33 @@ def delete_lines_with_string(s, patterns):
     Make sure to remove lines containing words we dislike
 
     """
-    keepers = []
+    # a pattern spanning a line-break can never match within a line
+    patterns = tuple(p for p in patterns if '\n' not in p)
+
+    if not patterns:
+        return ' '.join(s.split('\n'))
+    if '' in patterns:  # matches every line
+        return ''
 
-    for line in s.split('\n'):
-        if not any(pattern in line for pattern in patterns):
-            keepers.append(line)
+    automaton = compile_patterns(patterns)
+    keepers = []
+    start = 0
+
+    # jump from match to match -- lines in between are all keepers
+    while True:
+        match = automaton.search(s, start)
+        if match is None:
+            keepers.append(s[start:].replace('\n', ' '))
+            break
+
+        begin = max(s.rfind('\n', start, match.start()) + 1, start)
+        if begin > start:
+            keepers.append(s[start:begin - 1].replace('\n', ' '))
+
+        end = s.find('\n', match.end())
+        if end == -1:
+            break
+        start = end + 1
 
     return ' '.join(keepers)
 
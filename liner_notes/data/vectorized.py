@@ -0,0 +1,202 @@
+"""Column-at-a-time cleaning backend -- pandas str methods over messages"""
+
+import html
+import itertools
+import re
+
+from liner_notes.data import utils
+from liner_notes.data.engine import NON_ASCII
+
+# what pyarrow's regex engine (RE2) cannot run: look-arounds and
+# back-references in the pattern, anything but \1-style groups in the
+# replacement
+LOOK_AROUND = re.compile(r'\(\?<?[=!]|\\[1-9]')
+TEMPLATE = re.compile(r'(?:[^\\]|\\[0-9])*')
+
+# ascii that Python's \s and str.split() count as whitespace but RE2
+# does not -- rows holding them are left to the engine
+RE2_WHITESPACE = r'[\x0b\x1c-\x1f]'
+
+
+def rules_of(engine_rules):
+    # expand fused rules back into their members, in pipeline order
+    for rule in engine_rules:
+        members = getattr(rule, 'rules', None)
+        if members is None:
+            yield rule
+        else:
+            yield from members.values()
+
+
+def native(rule):
+    # whether the string dtype can run rule without leaving pyarrow
+    members = getattr(rule, 'rules', None)
+    if members is not None:
+        return all(native(member) for member in members.values())
+
+    return (
+        isinstance(rule.replacement, str)
+        and not rule.regex.flags & ~re.UNICODE
+        and not LOOK_AROUND.search(rule.regex.pattern)
+        and TEMPLATE.fullmatch(rule.replacement) is not None
+    )
+
+
+def substitute(series, rule):
+    # only rows holding one of the rule's guard literals can match
+    if rule.guards:
+        mask = series.str.contains(rule.guards[0], regex=False)
+        for guard in rule.guards[1:]:
+            mask |= series.str.contains(guard, regex=False)
+        if not mask.any():
+            return series
+        if not mask.all():
+            series = series.copy()
+            series[mask] = substitute_all(series[mask], rule)
+            return series
+
+    return substitute_all(series, rule)
+
+
+def substitute_all(series, rule):
+    # Series.str.replace counts like re.sub except 'all' is -1, not 0
+    return series.str.replace(
+        rule.regex.pattern,
+        rule.replacement,
+        n=rule.count or -1,
+        regex=True,
+    )
+
+
+def trim_after(series, pattern):
+    # utils.trim_after: drop everything up to the first pattern
+    series = series.str.replace(f'(?s)^.*?{re.escape(pattern)}', '', n=1, regex=True)
+    return series.str.strip()
+
+
+def trim_before(series, pattern):
+    # utils.trim_before: drop the first pattern on, or the last
+    # character when there is none
+    found = series.str.contains(pattern, regex=False)
+    series = series.where(found, series.str.slice(stop=-1))
+    series = series.str.replace(f'(?s){re.escape(pattern)}.*', '', n=1, regex=True)
+    return series.str.strip()
+
+
+def replace(series, patterns, replacement=''):
+    # utils.replace: each pattern in turn, as plain substrings
+    for pattern in patterns:
+        series = series.str.replace(pattern, replacement, regex=False)
+    return series
+
+
+# column forms of the engine's steps, the rest run row by row
+STEPS = {
+    utils.trim_after: trim_after,
+    utils.trim_before: trim_before,
+    utils.replace: replace,
+}
+
+
+def normalize(s):
+    return ' '.join(s.split())
+
+
+def apply_all(series, stages):
+    # stages pyarrow cannot run, in one pass of Python over the rows
+    def apply(s):
+        for stage in stages:
+            s = stage(s)
+        return s
+
+    if not stages:
+        return series
+    return series.astype(object).map(apply).astype('str')
+
+
+def clean_series(messages, engine):
+    """Clean a column of raw messages one stage at a time.
+
+    Each stage of engine.clean_message is applied to the whole column
+    with the equivalent pandas str method, kept in pandas' pyarrow-backed
+    string dtype.  What pyarrow cannot run -- rules with look-arounds or
+    back-references, html.unescape, the translation table and line
+    deletion -- goes through Python, only on the rows it can change
+    where that is known, and consecutive Python stages share one pass.
+    Rows RE2 would read differently are cleaned by the engine itself.
+
+    Parameters
+    ----------
+    messages : pandas.Series
+        raw email bodies
+    engine : engine.CleaningEngine
+        rule tables to apply, e.g. garagiste.ENGINE
+
+    Returns
+    -------
+    labels, notes : pandas.Series
+        same index as messages, identical to engine.clean_message
+
+    """
+    messages = messages.astype('str')
+    non_ascii = messages.str.contains(NON_ASCII.pattern)
+
+    msg = messages.str.lower()
+    if non_ascii.any():
+        # RE2 and Python lower-case some non-ascii letters differently
+        msg[non_ascii] = messages[non_ascii].map(str.lower)
+
+    entities = msg.str.contains('&', regex=False)
+    if entities.any():
+        msg[entities] = msg[entities].map(html.unescape)
+
+    # only the non-ascii runs need the translation table
+    non_ascii = msg.str.contains(NON_ASCII.pattern)
+    if non_ascii.any():
+        msg[non_ascii] = msg[non_ascii].str.replace(NON_ASCII, engine._to_ascii, regex=True)
+
+    ignore_case = '(?i)' if engine.label.flags & re.IGNORECASE else ''
+    labels = msg.str.extract(ignore_case + engine.label.pattern, expand=True)[0]
+    labels = labels.fillna('empty')
+    for rule in engine.label_rules:
+        labels = substitute(labels, rule)
+
+    special = msg.str.contains(RE2_WHITESPACE)
+
+    # Python stages are held back and run together in one pass over the
+    # rows, just before the next column-wide stage
+    pending = []
+
+    for step in engine.steps:
+        if step.func not in STEPS:
+            pending.append(step)
+            continue
+        msg = apply_all(msg, pending)
+        pending = []
+        msg = STEPS[step.func](msg, *step.args)
+
+    for is_native, rules in itertools.groupby(engine.rules, key=native):
+        if not is_native:
+            # fused rules stay fused, the engine's guards apply per row
+            pending.extend(rules)
+            continue
+        msg = apply_all(msg, pending)
+        pending = []
+        for rule in rules_of(rules):
+            msg = substitute(msg, rule)
+
+    notes = apply_all(msg, pending + [normalize])  # normalize whitespace
+
+    if special.any():
+        labels, notes = labels.astype(object), notes.astype(object)
+        for i in special.to_numpy().nonzero()[0]:
+            labels.iloc[i], notes.iloc[i] = engine.clean_message(messages.iloc[i])
+
+    return labels, notes
+
+
+def clean_frame(df, engine):
+    """Add 'labels' and 'notes' columns cleaned from df['message']."""
+    df = df.copy()
+    df['labels'], df['notes'] = clean_series(df['message'], engine)
+    return df
@@ -0,0 +1,161 @@
+"""Throughput of the model-input tokenization path
+
+Times the original path (pure-Python BertTokenizer, label mask built
+token by token) against the current one (Rust-backed BertTokenizerFast,
+vectorized mask, multi-process map) and checks they agree:
+
+    python -m liner_notes.model.bench ../data/garagiste_wine_clean.arrow --num-proc 8
+
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from liner_notes.model.corpus import load_corpus
+from liner_notes.model.tokenized import model_inputs
+
+COLUMNS = ['input_ids', 'attention_mask', 'decoder_input_ids', 'decoder_attention_mask', 'labels']
+
+
+def legacy_model_inputs(batch, tokenizer, max_length):
+    # ed.process_data_to_model_inputs before the fast tokenizer, the baseline
+    tok_params = {
+        'padding': 'max_length',
+        'truncation': True,
+        'max_length': max_length,
+    }
+    inputs = tokenizer(batch['name'], **tok_params)
+    outputs = tokenizer(batch['note'], **tok_params)
+
+    batch['input_ids'] = inputs.input_ids
+    batch['attention_mask'] = inputs.attention_mask
+    batch['decoder_input_ids'] = outputs.input_ids
+    batch['decoder_attention_mask'] = outputs.attention_mask
+    batch['labels'] = [
+        [-100 if token == tokenizer.pad_token_id else token for token in labels]
+        for labels in outputs.input_ids
+    ]
+
+    return batch
+
+
+def tokenize(data, func, tokenizer, max_length, batch_size, num_proc=None):
+    # seconds to map func over data and the resulting columns as arrays
+    start = time.perf_counter()
+    out = data.map(
+        func,
+        batched=True,
+        batch_size=batch_size,
+        remove_columns=data.column_names,
+        fn_kwargs={'tokenizer': tokenizer, 'max_length': max_length},
+        num_proc=num_proc,
+        load_from_cache_file=False,
+    )
+    elapsed = time.perf_counter() - start
+    out.set_format('numpy', columns=COLUMNS)
+    return elapsed, {column: out[column] for column in COLUMNS}
+
+
+def run(corpus, tokenizer_name='bert-base-uncased', split='train', limit=None,
+        max_length=128, batch_size=1000, num_proc=None, verbose=False):
+    """Examples/sec of the legacy and current tokenization paths.
+
+    Parameters
+    ----------
+    corpus : string
+        cleaned corpus understood by corpus.load_corpus
+    tokenizer_name : string, default 'bert-base-uncased'
+    split : string, default 'train'
+    limit : int, default None
+        only the first limit rows
+    max_length : int, default 128
+    batch_size : int, default 1000
+        map batch size
+    num_proc : int, default None
+        processes for the multi-process run, None uses every core
+    verbose : bool, default False
+        if True prints each timing
+
+    Returns
+    -------
+    results : dict
+        examples/sec per path and whether every column matched the legacy
+        path exactly
+
+    Raises
+    ------
+    AssertionError
+        if input_ids or labels differ from the legacy path
+
+    """
+    from transformers import BertTokenizer, BertTokenizerFast
+
+    data = load_corpus(corpus, split=split)
+    if limit is not None:
+        data = data.select(range(min(limit, len(data))))
+    num_proc = num_proc or os.cpu_count()
+
+    runs = [
+        ('legacy', legacy_model_inputs, BertTokenizer.from_pretrained(tokenizer_name), None),
+        ('fast', model_inputs, BertTokenizerFast.from_pretrained(tokenizer_name), None),
+        (f'fast x{num_proc}', model_inputs, BertTokenizerFast.from_pretrained(tokenizer_name), num_proc),
+    ]
+
+    results = {'examples': len(data), 'examples_per_sec': {}, 'identical': {}}
+    reference = None
+
+    for name, func, tokenizer, procs in runs:
+        elapsed, columns = tokenize(data, func, tokenizer, max_length, batch_size, procs)
+        results['examples_per_sec'][name] = len(data) / elapsed
+
+        if reference is None:
+            reference = columns
+        results['identical'][name] = all(
+            np.array_equal(columns[c], reference[c]) for c in COLUMNS
+        )
+        for column in ('input_ids', 'labels'):
+            assert np.array_equal(columns[column], reference[column]), f'{name} {column} differ'
+
+        if verbose:
+            print(f'{name:12s} {results["examples_per_sec"][name]:10.1f} examples/s')
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('corpus')
+    parser.add_argument('--tokenizer', default='bert-base-uncased')
+    parser.add_argument('--split', default='train')
+    parser.add_argument('--limit', type=int)
+    parser.add_argument('--max-length', type=int, default=128)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--num-proc', type=int)
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args(argv)
+
+    results = run(
+        args.corpus,
+        tokenizer_name=args.tokenizer,
+        split=args.split,
+        limit=args.limit,
+        max_length=args.max_length,
+        batch_size=args.batch_size,
+        num_proc=args.num_proc,
+        verbose=True,
+    )
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    return 0 if all(results['identical'].values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,211 @@
+"""Cache of generated descriptions -- in-memory LRU over optional SQLite"""
+
+import collections
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+from liner_notes.data.garagiste import normalize_label
+
+
+# generation parameters that change the output, read off the model's
+# generation config unless passed to generate() explicitly
+GENERATION_PARAMS = (
+    'num_beams',
+    'max_length',
+    'min_length',
+    'no_repeat_ngram_size',
+    'length_penalty',
+    'early_stopping',
+    'do_sample',
+)
+
+
+def checkpoint_identity(checkpoint):
+    """Digest of a checkpoint directory -- its path and files' size and mtime.
+
+    Cheap to compute for a 1 GB model, and changes whenever a checkpoint
+    is overwritten.
+
+    """
+    checkpoint = os.path.realpath(os.path.expanduser(checkpoint))
+    h = hashlib.blake2b(digest_size=16)
+    h.update(checkpoint.encode())
+
+    for name in sorted(os.listdir(checkpoint)):
+        stat = os.stat(os.path.join(checkpoint, name))
+        h.update(f'{name}:{stat.st_size}:{stat.st_mtime_ns}'.encode())
+
+    return h.hexdigest()
+
+
+def generation_params(ed_model, **generate_kwargs):
+    """The generation parameters generate() will use, as a plain dict."""
+    config = ed_model.generation_config
+    params = {name: getattr(config, name, None) for name in GENERATION_PARAMS}
+    params.update(generate_kwargs)
+    return params
+
+
+class GenerationCache:
+    """Descriptions keyed by normalized label, checkpoint and decode config.
+
+    Lookups go to an in-memory LRU first, then to the SQLite file when
+    one is given.  Labels are normalized like garagiste.get_label, so
+    '2009 Charvin 750ml' and '2009 charvin' share an entry.  Safe to
+    share between threads.
+
+    Parameters
+    ----------
+    checkpoint : string
+        identity of the model, see checkpoint_identity()
+    params : dict
+        generation parameters, see generation_params()
+    maxsize : int, default 10000
+        entries kept in memory
+    path : string, default None
+        SQLite database for the persistent tier, created if missing
+
+    Example
+    -------
+    >>> cache = GenerationCache(checkpoint_identity('./checkpoint-500'),
+    ...                         generation_params(ed_model))
+    >>> cache.describe(names, lambda misses: describe(misses, tokenizer, ed_model))
+    >>> cache.stats()['hit_rate']
+    0.93
+
+    """
+
+    def __init__(self, checkpoint, params, maxsize=10000, path=None):
+        self.prefix = json.dumps([checkpoint, params], sort_keys=True, default=str).encode()
+        self.maxsize = maxsize
+        self.memory = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(os.path.expanduser(path), check_same_thread=False)
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS generated ('
+                ' key BLOB PRIMARY KEY,'
+                ' description TEXT NOT NULL'
+                ')'
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.db is not None:
+            with self.lock:
+                self.db.commit()
+                self.db.close()
+                self.db = None
+
+    def key(self, name):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(self.prefix)
+        digest.update(b'\0')
+        digest.update(normalize_label(name).encode())
+        return digest.digest()
+
+    def _remember(self, key, description):
+        # caller holds the lock
+        self.memory[key] = description
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.maxsize:
+            self.memory.popitem(last=False)
+
+    def get(self, name):
+        """Cached description of name, or None."""
+        return self._get(self.key(name))
+
+    def _get(self, key):
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                return self.memory[key]
+
+            if self.db is not None:
+                row = self.db.execute(
+                    'SELECT description FROM generated WHERE key = ?', (key,),
+                ).fetchone()
+                if row is not None:
+                    self._remember(key, row[0])
+                    self.disk_hits += 1
+                    return row[0]
+
+            self.misses += 1
+            return None
+
+    def put(self, items):
+        """Store (name, description) items."""
+        self._put([(self.key(name), description) for name, description in items])
+
+    def _put(self, items):
+        items = list(items)
+        with self.lock:
+            for key, description in items:
+                self._remember(key, description)
+            if self.db is not None:
+                self.db.executemany(
+                    'INSERT OR REPLACE INTO generated VALUES (?, ?)', items,
+                )
+                self.db.commit()
+
+    def describe(self, names, func):
+        """Describe names, only running func on the ones not cached.
+
+        Parameters
+        ----------
+        names : sequence
+            wine labels
+        func : callable
+            maps a list of labels to a list of descriptions, e.g.
+            describe.describe with the model bound
+
+        Returns
+        -------
+        descriptions : list
+            in the same order as names
+
+        """
+        names = list(names)
+        keys = [self.key(name) for name in names]
+        found = {}
+        todo = {}  # labels normalizing alike are only generated once
+
+        for key, name in zip(keys, names):
+            if key in found or key in todo:
+                continue
+            description = self._get(key)
+            if description is None:
+                todo[key] = name
+            else:
+                found[key] = description
+
+        if todo:
+            generated = list(func(list(todo.values())))
+            self._put(zip(todo, generated))
+            found.update(zip(todo, generated))
+
+        return [found[key] for key in keys]
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            'entries': len(self.memory),
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else None,
+        }
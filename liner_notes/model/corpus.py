@@ -0,0 +1,43 @@
+"""Load the cleaned corpus written by liner_notes.data.garagiste.clean"""
+
+import os
+
+from datasets import Dataset, ReadInstruction, load_dataset
+
+
+def load_corpus(path, split='train'):
+    """Load the cleaned (name, note) corpus as a datasets.Dataset.
+
+    '.arrow' files (garagiste.save) are memory-mapped in place -- no
+    parsing or copying at start-up.  '.parquet' and '.csv' files go
+    through load_dataset, which converts them to its own Arrow cache.
+
+    Parameters
+    ----------
+    path : string
+        path to the '.arrow', '.parquet' or '.csv' corpus
+    split : string, default 'train'
+        split spec as understood by load_dataset, e.g. 'train[:90%]'
+
+    Returns
+    -------
+    ds : datasets.Dataset
+
+    Example
+    -------
+    >>> val_data = load_corpus('garagiste_wine_clean.arrow', 'train[90%:]')
+
+    """
+    path = os.path.expanduser(path)
+
+    if path.endswith('.arrow'):
+        ds = Dataset.from_file(path)
+        # same percent / absolute slicing rules as load_dataset
+        instruction = ReadInstruction.from_spec(split)
+        bounds = instruction.to_absolute({'train': len(ds)})[0]
+        if (bounds.from_, bounds.to) != (0, len(ds)):
+            ds = ds.select(range(bounds.from_, bounds.to))
+        return ds
+
+    builder = 'parquet' if path.endswith('.parquet') else 'csv'
+    return load_dataset(builder, data_files=path, split=split)
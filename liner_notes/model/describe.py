@@ -1,23 +1,65 @@
 import torch
-from transformers import BertTokenizer, EncoderDecoderModel
+from transformers import BertTokenizerFast
 
+from liner_notes.model.quantize import is_quantized, load_checkpoint
 
-input_str = '1999 chevillon nuit saints georges villages france'
 
 encoder_max_length = 128
 device = 'cuda' if torch.cuda.is_available() else 'cpu'
 
-tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
-ed_model = EncoderDecoderModel.from_pretrained('./checkpoint-500')
-ed_model.to(device)
 
-inputs = tokenizer(input_str, padding='max_length', truncation=True,
-                   max_length=encoder_max_length, return_tensors='pt')
-input_ids = inputs.input_ids.to(device)
-attention_mask = inputs.attention_mask.to(device)
-outputs = ed_model.generate(input_ids, attention_mask=attention_mask)
-output_str = tokenizer.batch_decode(outputs, skip_special_tokens=True)[0]
+def load_model(checkpoint='./checkpoint-500', tokenizer_name='bert-base-uncased'):
+    # load once and keep resident -- returns (tokenizer, ed_model)
+    # fp32 or int8 (see quantize.py) checkpoints, int8 stays on the CPU
+    tokenizer = BertTokenizerFast.from_pretrained(tokenizer_name)
+    ed_model = load_checkpoint(checkpoint)
+    ed_model.to('cpu' if is_quantized(checkpoint) else device)
+    ed_model.eval()
+    return tokenizer, ed_model
 
-print(f'NAME\n{input_str}')
-print()
-print(f'DESCRIPTION\n{output_str}')
\ No newline at end of file
+
+def describe(names, tokenizer, ed_model, batch_size=None, padding='longest',
+             **generate_kwargs):
+    # generate a description for every name, batch_size names per generate()
+    ids = tokenizer(list(names), truncation=True, max_length=encoder_max_length).input_ids
+    return describe_ids(ids, tokenizer, ed_model, batch_size, padding, **generate_kwargs)
+
+
+def describe_ids(ids, tokenizer, ed_model, batch_size=None, padding='longest',
+                 **generate_kwargs):
+    # describe() for names already tokenized (unpadded input ids)
+    # padding='longest' pads each batch only to its longest name and names
+    # are bucketed by length first, so a batch of short labels no longer runs
+    # 128-token attention mostly over [PAD] -- 'max_length' is the old behavior
+    batch_size = batch_size or len(ids)
+    if padding == 'longest':
+        order = sorted(range(len(ids)), key=lambda i: len(ids[i]))
+    else:
+        order = list(range(len(ids)))
+    descriptions = [None] * len(ids)
+
+    for start in range(0, len(order), batch_size):
+        index = order[start:start + batch_size]
+        inputs = tokenizer.pad({'input_ids': [ids[i] for i in index]}, padding=padding,
+                               max_length=encoder_max_length, return_tensors='pt')
+        input_ids = inputs.input_ids.to(ed_model.device)
+        attention_mask = inputs.attention_mask.to(ed_model.device)
+        with torch.no_grad():
+            outputs = ed_model.generate(input_ids, attention_mask=attention_mask,
+                                        **generate_kwargs)
+        # back to the caller's order
+        for i, description in zip(index, tokenizer.batch_decode(outputs, skip_special_tokens=True)):
+            descriptions[i] = description
+
+    return descriptions
+
+
+if __name__ == '__main__':
+    input_str = '1999 chevillon nuit saints georges villages france'
+
+    tokenizer, ed_model = load_model()
+    output_str = describe([input_str], tokenizer, ed_model)[0]
+
+    print(f'NAME\n{input_str}')
+    print()
+    print(f'DESCRIPTION\n{output_str}')
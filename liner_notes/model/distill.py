@@ -0,0 +1,183 @@
+"""Knowledge distillation of a trained checkpoint into a shallower student
+
+ed.py trains the student when teacher_checkpoint is set.  Compare the two
+afterwards:
+
+    python -m liner_notes.model.distill ./checkpoint-2500 ./student/checkpoint-2500 \
+        --corpus ../data/garagiste_wine_clean.arrow --report distill.json
+
+"""
+
+import argparse
+import copy
+import json
+import re
+import sys
+
+import torch
+import torch.nn.functional as F
+from transformers import EncoderDecoderModel, Seq2SeqTrainer
+
+# encoder.encoder.layer.3.attention... / decoder.bert.encoder.layer.3.output...
+LAYER = re.compile(r'^(encoder|decoder)\.(.*?layer\.)(\d+)\.')
+
+
+def spread(n_teacher, n_student):
+    # evenly spaced teacher layers, always keeping the first and the last
+    if n_student == 1:
+        return [n_teacher - 1]
+    return [round(i * (n_teacher - 1) / (n_student - 1)) for i in range(n_student)]
+
+
+def make_student(teacher, decoder_layers, encoder_layers=None):
+    """Shallower copy of teacher, initialized from its weights.
+
+    The student keeps the teacher's widths and vocabulary so the logits
+    line up.  Each student layer starts as one of evenly spaced teacher
+    layers, and everything outside the layers (embeddings, pooler, LM
+    head) is copied as-is.
+
+    Parameters
+    ----------
+    teacher : EncoderDecoderModel
+    decoder_layers : int
+        student decoder depth
+    encoder_layers : int, default None
+        student encoder depth, None keeps the teacher's
+
+    Returns
+    -------
+    student : EncoderDecoderModel
+
+    """
+    config = copy.deepcopy(teacher.config)
+    layers = {
+        'encoder': spread(config.encoder.num_hidden_layers,
+                          encoder_layers or config.encoder.num_hidden_layers),
+        'decoder': spread(config.decoder.num_hidden_layers, decoder_layers),
+    }
+    config.encoder.num_hidden_layers = len(layers['encoder'])
+    config.decoder.num_hidden_layers = len(layers['decoder'])
+
+    student = EncoderDecoderModel(config=config)
+    teacher_state = teacher.state_dict()
+    state = {}
+
+    for key in student.state_dict():
+        match = LAYER.match(key)
+        source = key
+        if match:
+            side, path, i = match.groups()
+            source = f'{side}.{path}{layers[side][int(i)]}.' + key[match.end():]
+        state[key] = teacher_state[source]
+
+    student.load_state_dict(state)
+    student.generation_config = copy.deepcopy(teacher.generation_config)
+    return student
+
+
+class DistillationTrainer(Seq2SeqTrainer):
+    """Seq2SeqTrainer that also matches a teacher's output distribution.
+
+    loss = alpha * cross-entropy on the labels
+         + (1 - alpha) * T**2 * KL(teacher || student) at temperature T
+
+    over the target positions that are not -100.  Without a teacher it
+    is a plain Seq2SeqTrainer.
+
+    Parameters
+    ----------
+    teacher : EncoderDecoderModel, default None
+    alpha : float, default 0.5
+        weight of the label loss
+    temperature : float, default 2.0
+        softens both distributions before they are compared
+
+    """
+
+    def __init__(self, *args, teacher=None, alpha=0.5, temperature=2.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.teacher = teacher
+        self.alpha = alpha
+        self.temperature = temperature
+        if teacher is not None:
+            self.teacher.to(self.args.device).eval()
+            self.teacher.requires_grad_(False)
+
+    def compute_loss(self, model, inputs, return_outputs=False, **kwargs):
+        if self.teacher is None:
+            return super().compute_loss(model, inputs, return_outputs=return_outputs, **kwargs)
+
+        outputs = model(**inputs)
+        with torch.no_grad():
+            teacher_logits = self.teacher(**inputs).logits
+
+        mask = inputs['labels'] != -100
+        t = self.temperature
+        distill = F.kl_div(
+            F.log_softmax(outputs.logits[mask] / t, dim=-1),
+            F.softmax(teacher_logits[mask] / t, dim=-1),
+            reduction='batchmean',
+        ) * t * t
+        loss = self.alpha * outputs.loss + (1 - self.alpha) * distill
+
+        return (loss, outputs) if return_outputs else loss
+
+
+def compare(teacher, student, tokenizer, names, notes, **kwargs):
+    """Tokens/sec, labels/sec and ROUGE-2 of a teacher and a student checkpoint."""
+    from liner_notes.model.quantize import load_checkpoint, measure
+
+    report = {'samples': len(names)}
+    for name, path in (('teacher', teacher), ('student', student)):
+        ed_model = load_checkpoint(path)
+        report[name] = measure(ed_model, tokenizer, names, notes, **kwargs)
+        report[name]['decoder_layers'] = ed_model.config.decoder.num_hidden_layers
+        report[name]['encoder_layers'] = ed_model.config.encoder.num_hidden_layers
+        del ed_model
+
+    report['rouge2_delta'] = report['student']['rouge2_fmeasure'] - report['teacher']['rouge2_fmeasure']
+    report['speedup'] = report['student']['tokens_per_sec'] / report['teacher']['tokens_per_sec']
+
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('teacher', help='teacher checkpoint directory')
+    parser.add_argument('student', help='student checkpoint directory')
+    parser.add_argument('--corpus', required=True, help='cleaned corpus to compare on')
+    parser.add_argument('--tokenizer', default='bert-base-uncased')
+    parser.add_argument('--split', default='train[90%:]')
+    parser.add_argument('--samples', type=int, default=64)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--report', help='write the comparison as JSON')
+    args = parser.parse_args(argv)
+
+    from transformers import BertTokenizerFast
+
+    from liner_notes.model.corpus import load_corpus
+
+    tokenizer = BertTokenizerFast.from_pretrained(args.tokenizer)
+    data = load_corpus(args.corpus, split=args.split)
+    data = data.select(range(min(args.samples, len(data))))
+
+    report = compare(args.teacher, args.student, tokenizer,
+                     list(data['name']), list(data['note']), batch_size=args.batch_size)
+
+    for name in ('teacher', 'student'):
+        r = report[name]
+        print(f"{name:8s} {r['encoder_layers']:2d}+{r['decoder_layers']:<2d} layers  "
+              f"{r['tokens_per_sec']:9.1f} tokens/s  {r['labels_per_sec']:7.2f} labels/s  "
+              f"rouge2 {r['rouge2_fmeasure']:.4f}")
+    print(f"speedup {report['speedup']:.2f}x  rouge2 delta {report['rouge2_delta']:+.4f}")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
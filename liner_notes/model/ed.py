@@ -1,79 +1,133 @@
+import os
+
 import torch
-from datasets import load_dataset, load_metric
-from transformers import BertTokenizer, EncoderDecoderModel
-from transformers import Seq2SeqTrainer, Seq2SeqTrainingArguments
+from transformers import BertTokenizerFast, EncoderDecoderModel
+from transformers import Seq2SeqTrainingArguments
+
+from liner_notes.model.distill import DistillationTrainer, make_student
+from liner_notes.model.scoring import RougeScorer
+from liner_notes.model.tokenized import load_tokenized, model_inputs
 
 
-tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
+# Rust-backed tokenizer, same ids as BertTokenizer
+tokenizer = BertTokenizerFast.from_pretrained('bert-base-uncased')
 tokenizer.bos_token = tokenizer.cls_token
 tokenizer.eos_token = tokenizer.sep_token
 
-csv_file = '../data/garagiste_wine_clean.csv'
-val_data = load_dataset('csv', data_files=csv_file, split='train[90%:]')
-train_data = load_dataset('csv', data_files=csv_file, split='train[:90%]')
-print(val_data)
-print(train_data)
+# '.arrow' output of garagiste.clean is memory-mapped, '.csv' still works
+corpus_file = '../data/garagiste_wine_clean.arrow'
 
 batch_size = 16  # 4 but change to 16 for full training
 encoder_max_length = 128
-decoder_max_length = 2048
+decoder_max_length = 512  # BERT position embeddings stop at 512
 device = 'cuda' if torch.cuda.is_available() else 'cpu'
+# store unpadded ids, batch similar lengths together and pad per batch
+# False pads every example to encoder_max_length as before
+dynamic_padding = True
+# distillation -- a trained checkpoint as teacher trains a shallower
+# student, logit-matched to it; None trains bert2bert from scratch
+teacher_checkpoint = None
+student_decoder_layers = 3
+student_encoder_layers = None  # None keeps the teacher's encoder depth
 
 
 def process_data_to_model_inputs(batch):
-    # tokenize the inputs and labels
-    tok_params = {
-        'padding': 'max_length',
-        'truncation': True,
-        'max_length': encoder_max_length,
-    }
-    inputs = tokenizer(batch['name'], **tok_params)
-    outputs = tokenizer(batch['note'], **tok_params)
+    # tokenize the inputs and labels, padded to encoder_max_length
+    # because BERT automatically shifts the labels, the labels correspond exactly to `decoder_input_ids`.
+    # model_inputs replaces the PAD token in the labels with -100 so it is ignored
+    return model_inputs(batch, tokenizer, encoder_max_length)
+
+
+def tokenize_unpadded(batch):
+    # token ids only -- DynamicPaddingCollator pads each batch
+    inputs = tokenizer(batch['name'], truncation=True, max_length=encoder_max_length)
+    outputs = tokenizer(batch['note'], truncation=True, max_length=decoder_max_length)
 
     batch['input_ids'] = inputs.input_ids
-    batch['attention_mask'] = inputs.attention_mask
     batch['decoder_input_ids'] = outputs.input_ids
-    batch['decoder_attention_mask'] = outputs.attention_mask
-    batch['labels'] = outputs.input_ids.copy()
-
-    # because BERT automatically shifts the labels, the labels correspond exactly to `decoder_input_ids`.
-    # We have to make sure that the PAD token is ignored
-    batch['labels'] = [
-        [-100 if token == tokenizer.pad_token_id else token for token in labels] for labels in batch['labels']
-    ]
+    # read by group_by_length to put examples of similar size in a batch
+    batch['length'] = [len(i) + len(o) for i, o in zip(inputs.input_ids, outputs.input_ids)]
 
     return batch
 
 
+class DynamicPaddingCollator:
+    # pad names and notes to the longest in the batch, ignore label padding
+    # with -100 and count the padding so the trainer can log the ratio
+
+    def __init__(self, pad_token_id):
+        self.pad_token_id = pad_token_id
+        self.tokens = 0
+        self.padding = 0
+
+    @staticmethod
+    def pad(sequences, value):
+        width = max(len(s) for s in sequences)
+        return torch.tensor([list(s) + [value] * (width - len(s)) for s in sequences])
+
+    def __call__(self, features):
+        names = [f['input_ids'] for f in features]
+        notes = [f['decoder_input_ids'] for f in features]
+
+        batch = {
+            'input_ids': self.pad(names, self.pad_token_id),
+            'attention_mask': self.pad([[1] * len(s) for s in names], 0),
+            'decoder_input_ids': self.pad(notes, self.pad_token_id),
+            'decoder_attention_mask': self.pad([[1] * len(s) for s in notes], 0),
+            'labels': self.pad(notes, -100),
+        }
+
+        real = sum(map(len, names)) + sum(map(len, notes))
+        total = batch['input_ids'].numel() + batch['decoder_input_ids'].numel()
+        self.tokens += total
+        self.padding += total - real
+
+        return batch
+
+    def padding_ratio(self):
+        # fraction of the tokens seen so far that were padding
+        ratio = self.padding / self.tokens if self.tokens else 0.0
+        self.tokens = self.padding = 0
+        return ratio
+
+
+if dynamic_padding:
+    prepare = tokenize_unpadded
+    data_collator = DynamicPaddingCollator(tokenizer.pad_token_id)
+else:
+    prepare = process_data_to_model_inputs
+    data_collator = None
+columns = ['input_ids', 'attention_mask', 'decoder_input_ids', 'decoder_attention_mask', 'labels']
+
+
+# tokenized once per corpus / tokenizer / max lengths, later runs
+# memory-map the cached Arrow in ./tokenized instead of re-tokenizing
+tok_settings = {
+    'remove_columns': ['name', 'note'],
+    'num_proc': os.cpu_count(),
+    'encoder_max_length': encoder_max_length,
+    'decoder_max_length': decoder_max_length,
+}
+train_data = load_tokenized(corpus_file, 'train[:90%]', prepare, tokenizer, **tok_settings)
+val_data = load_tokenized(corpus_file, 'train[90%:]', prepare, tokenizer, **tok_settings)
+print(val_data)
+print(train_data)
+
 # only use 32 training examples for notebook - COMMENT LINE FOR FULL TRAINING
 # train_data = train_data.select(range(32))
-
-train_data = train_data.map(
-    process_data_to_model_inputs,
-    batched=True,
-    batch_size=batch_size,
-    remove_columns=['name', 'note'],
-)
-train_data.set_format(
-    type='torch',
-    columns=['input_ids', 'attention_mask', 'decoder_input_ids', 'decoder_attention_mask', 'labels'],
-)
-
 # only use 16 training examples for notebook - DELETE LINE FOR FULL TRAINING
 # val_data = val_data.select(range(16))
 
-val_data = val_data.map(
-    process_data_to_model_inputs,
-    batched=True,
-    batch_size=batch_size,
-    remove_columns=['name', 'note'],
-)
-val_data.set_format(
-    type='torch',
-    columns=['input_ids', 'attention_mask', 'decoder_input_ids', 'decoder_attention_mask', 'labels'],
-)
+if not dynamic_padding:
+    train_data.set_format(type='torch', columns=columns)
+    val_data.set_format(type='torch', columns=columns)
 
-ed_model = EncoderDecoderModel.from_encoder_decoder_pretrained('bert-base-uncased', 'bert-base-uncased')
+if teacher_checkpoint:
+    teacher = EncoderDecoderModel.from_pretrained(teacher_checkpoint)
+    ed_model = make_student(teacher, student_decoder_layers, student_encoder_layers)
+else:
+    teacher = None
+    ed_model = EncoderDecoderModel.from_encoder_decoder_pretrained('bert-base-uncased', 'bert-base-uncased')
 
 # set special tokens
 ed_model.config.decoder_start_token_id = tokenizer.bos_token_id
@@ -90,20 +144,25 @@ ed_model.config.length_penalty = 2.0
 ed_model.config.num_beams = 4
 
 
-# load rouge for validation
-rouge = load_metric('rouge')
+# rouge for validation -- scored on a worker pool kept across eval steps
+rouge = RougeScorer(['rouge2'], workers=os.cpu_count())
+rouge_chunk = 256  # predictions decoded while the pool scores the last chunk
 
 
 def compute_metrics(pred):
     labels_ids = pred.label_ids
     pred_ids = pred.predictions
-
-    # all unnecessary tokens are removed
-    pred_str = tokenizer.batch_decode(pred_ids, skip_special_tokens=True)
     labels_ids[labels_ids == -100] = tokenizer.pad_token_id
-    label_str = tokenizer.batch_decode(labels_ids, skip_special_tokens=True)
+    pred_ids[pred_ids == -100] = tokenizer.pad_token_id  # padding between eval batches
+
+    for start in range(0, len(pred_ids), rouge_chunk):
+        # all unnecessary tokens are removed
+        pred_str = tokenizer.batch_decode(pred_ids[start:start + rouge_chunk], skip_special_tokens=True)
+        label_str = tokenizer.batch_decode(labels_ids[start:start + rouge_chunk], skip_special_tokens=True)
+        rouge.add(pred_str, label_str)
 
-    rouge_output = rouge.compute(predictions=pred_str, references=label_str, rouge_types=['rouge2'])['rouge2'].mid
+    rouge_output = rouge.compute()['rouge2'].mid
+    rouge.reset()
 
     return {
         'rouge2_precision': round(rouge_output.precision, 4),
@@ -114,7 +173,7 @@ def compute_metrics(pred):
 
 # set training arguments - these params are not really tuned, feel free to change
 training_args = Seq2SeqTrainingArguments(
-    output_dir='./',
+    output_dir='./student/' if teacher_checkpoint else './',
     evaluation_strategy='steps',
     per_device_train_batch_size=batch_size,
     per_device_eval_batch_size=batch_size,
@@ -127,13 +186,27 @@ training_args = Seq2SeqTrainingArguments(
     overwrite_output_dir=True,
     save_total_limit=3,
     fp16=torch.cuda.is_available(),
+    group_by_length=dynamic_padding,
+    length_column_name='length',
 )
 
+
+class PaddingRatioTrainer(DistillationTrainer):
+    # adds the share of padded tokens since the last log to every log line
+
+    def log(self, logs, *args, **kwargs):
+        if data_collator is not None:
+            logs['padding_ratio'] = round(data_collator.padding_ratio(), 4)
+        super().log(logs, *args, **kwargs)
+
+
 # instantiate trainer
-trainer = Seq2SeqTrainer(
+trainer = PaddingRatioTrainer(
     model=ed_model,
     tokenizer=tokenizer,
     args=training_args,
+    data_collator=data_collator,
+    teacher=teacher,
     compute_metrics=compute_metrics,
     train_dataset=train_data,
     eval_dataset=val_data,
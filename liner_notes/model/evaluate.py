@@ -0,0 +1,284 @@
+"""Streaming, resumable batch evaluation of a checkpoint on a corpus file
+
+Predictions are appended to the output CSV batch by batch.  Interrupt it
+and run the same command again to carry on after the last finished batch:
+
+    python -m liner_notes.model.evaluate ./checkpoint-1500 ../data/test.csv predictions.csv
+
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from liner_notes.model.retrieval import RetrievalIndex
+from liner_notes.model.scoring import RougeScorer
+
+
+def read_columns(path, chunksize=10000, columns=('name', 'note')):
+    """Yield a tuple of lists, one per column, from a '.csv', '.parquet' or '.arrow' corpus."""
+    path = os.path.expanduser(path)
+    columns = list(columns)
+
+    if path.endswith('.arrow'):
+        with pa.memory_map(path) as source:
+            for batch in pa.ipc.open_stream(source):
+                yield tuple(batch.column(c).to_pylist() for c in columns)
+    elif path.endswith('.parquet'):
+        for batch in pq.ParquetFile(path).iter_batches(chunksize, columns=columns):
+            yield tuple(batch.column(c).to_pylist() for c in columns)
+    else:
+        reader = pd.read_csv(path, usecols=columns, chunksize=chunksize,
+                             keep_default_na=False, dtype=str)
+        for df in reader:
+            yield tuple(df[c].tolist() for c in columns)
+
+
+def read_batches(path, batch_size=64, skip=0, limit=None):
+    """Yield (names, notes) batches of batch_size rows, after skipping `skip` rows.
+
+    At most `limit` rows (counted from the start of the file) are read.
+
+    """
+    names, notes = [], []
+    row = 0
+
+    for chunk_names, chunk_notes in read_columns(path):
+        for name, note in zip(chunk_names, chunk_notes):
+            if limit is not None and row >= limit:
+                break
+            row += 1
+            if row <= skip:
+                continue
+            names.append(name)
+            notes.append(note)
+            if len(names) == batch_size:
+                yield names, notes
+                names, notes = [], []
+
+    if names:
+        yield names, notes
+
+
+def progress_file(output):
+    return f'{output}.progress'
+
+
+def read_progress(output):
+    # rows done and output bytes holding them, as of the last finished batch
+    try:
+        with open(progress_file(output)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_progress(output, progress):
+    # write-then-rename, so the watermark is never half written
+    tmp = f'{progress_file(output)}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(progress, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, progress_file(output))
+
+
+def predict(corpus, output, generate, batch_size=64, limit=None, identity=None,
+            verbose=False):
+    """Append predictions for every corpus row to the output CSV, resumably.
+
+    After each batch the rows are flushed to disk and a watermark (rows
+    done, output size) is saved beside the output.  A rerun truncates
+    anything written after the watermark and skips the rows it covers,
+    so no finished batch is generated twice or lost.
+
+    Parameters
+    ----------
+    corpus : string
+        '.csv', '.parquet' or '.arrow' file with name and note columns
+    output : string
+        CSV of name, note, pred -- created, or resumed if a watermark exists
+    generate : callable
+        maps a list of names to a list of descriptions
+    batch_size : int, default 64
+    limit : int, default None
+        only evaluate the first limit rows of the corpus
+    identity : dict, default None
+        what produced the output, e.g. checkpoint and corpus -- resuming
+        under a different identity raises ValueError
+    verbose : bool, default False
+        if True prints progress after each batch
+
+    Returns
+    -------
+    rows : int
+        rows in the output, from this and earlier runs
+
+    """
+    output = os.path.expanduser(output)
+    identity = identity or {}
+    progress = read_progress(output)
+
+    if progress is None:
+        with open(output, 'w', newline='') as f:
+            csv.writer(f, lineterminator='\n').writerow(['name', 'note', 'pred'])
+            progress = {'identity': identity, 'rows': 0, 'bytes': f.tell()}
+        write_progress(output, progress)
+    elif progress['identity'] != identity:
+        raise ValueError(
+            f'{output} was written by {progress["identity"]}, not {identity} '
+            f'-- remove it and {progress_file(output)} or pick another output'
+        )
+
+    start = time.perf_counter()
+    done = 0
+
+    with open(output, 'r+', newline='') as f:
+        # drop a batch that was being written when the last run stopped
+        f.truncate(progress['bytes'])
+        f.seek(progress['bytes'])
+        writer = csv.writer(f, lineterminator='\n')
+
+        for names, notes in read_batches(corpus, batch_size, skip=progress['rows'], limit=limit):
+            preds = generate(names)
+            writer.writerows(zip(names, notes, preds))
+            f.flush()
+            os.fsync(f.fileno())
+
+            progress['rows'] += len(names)
+            progress['bytes'] = f.tell()
+            write_progress(output, progress)
+
+            done += len(names)
+            if verbose:
+                rate = done / (time.perf_counter() - start)
+                print(f'{progress["rows"]} rows  {rate:.2f} labels/s')
+
+    return progress['rows']
+
+
+def score_file(output, workers=1, chunksize=1000, **kwargs):
+    """ROUGE-2 of the pred column against the note column of an output CSV.
+
+    Read chunksize rows at a time, so memory stays bounded.  Keyword
+    arguments go to RougeScorer.compute.
+
+    """
+    with RougeScorer(['rouge2'], workers=workers) as rouge:
+        reader = pd.read_csv(os.path.expanduser(output), usecols=['note', 'pred'],
+                             chunksize=chunksize, keep_default_na=False, dtype=str)
+        for df in reader:
+            rouge.add(df['pred'].tolist(), df['note'].tolist())
+        return rouge.compute(**kwargs)['rouge2']
+
+
+def evaluate(checkpoint, corpus, output, tokenizer_name='bert-base-uncased',
+             batch_size=64, limit=None, workers=None, cache_file=None, index_file=None,
+             threshold=0.9, verbose=False):
+    """Generate for a corpus file into output, then score the whole output.
+
+    Parameters
+    ----------
+    checkpoint : string
+        fp32 or int8 checkpoint directory
+    corpus : string
+        '.csv', '.parquet' or '.arrow' file with name and note columns
+    output : string
+        predictions CSV, resumed when a previous run was interrupted
+    tokenizer_name : string, default 'bert-base-uncased'
+    batch_size : int, default 64
+    limit : int, default None
+        only evaluate the first limit rows of the corpus
+    workers : int, default None
+        ROUGE scoring processes, None uses every core
+    cache_file : string, default None
+        SQLite generation cache, see cache.GenerationCache
+    index_file : string, default None
+        retrieval index consulted before generating, see retrieval.py --
+        build it from a corpus that excludes the evaluation rows
+    threshold : float, default 0.9
+        similarity an indexed label needs to be used
+    verbose : bool, default False
+
+    Returns
+    -------
+    metrics : dict
+        rows, ROUGE-2 precision / recall / F (mid) and the F interval,
+        plus the index hit rate when one is used
+
+    """
+    from liner_notes.model import describe
+    from liner_notes.model.cache import GenerationCache, checkpoint_identity, generation_params
+
+    tokenizer, ed_model = describe.load_model(checkpoint, tokenizer_name)
+    cache = GenerationCache(checkpoint_identity(checkpoint), generation_params(ed_model),
+                            path=cache_file)
+
+    index = RetrievalIndex.load(index_file) if index_file else None
+
+    def generate(names):
+        def model(misses):
+            return describe.describe(misses, tokenizer, ed_model, batch_size)
+
+        if index is not None:
+            return index.describe(names, lambda misses: cache.describe(misses, model), threshold)
+        return cache.describe(names, model)
+
+    identity = {'checkpoint': os.path.abspath(checkpoint), 'corpus': os.path.abspath(corpus)}
+    rows = predict(corpus, output, generate, batch_size=batch_size, limit=limit,
+                   identity=identity, verbose=verbose)
+    cache.close()
+
+    rouge2 = score_file(output, workers=workers or os.cpu_count())
+    metrics = {
+        'rows': rows,
+        'rouge2_precision': float(rouge2.mid.precision),
+        'rouge2_recall': float(rouge2.mid.recall),
+        'rouge2_fmeasure': float(rouge2.mid.fmeasure),
+        'rouge2_fmeasure_low': float(rouge2.low.fmeasure),
+        'rouge2_fmeasure_high': float(rouge2.high.fmeasure),
+    }
+    if index is not None:
+        metrics['index'] = index.stats()
+    return metrics
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description=__doc__.splitlines()[0])
+    parser.add_argument('checkpoint')
+    parser.add_argument('corpus', help="'.csv', '.parquet' or '.arrow' with name and note")
+    parser.add_argument('output', help='predictions CSV, resumed if interrupted')
+    parser.add_argument('--tokenizer', default='bert-base-uncased')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--limit', type=int, help='only the first LIMIT rows')
+    parser.add_argument('--workers', type=int, help='ROUGE processes, default every core')
+    parser.add_argument('--cache-file', help='SQLite generation cache')
+    parser.add_argument('--index', help='retrieval index consulted before generating')
+    parser.add_argument('--threshold', type=float, default=0.9)
+    args = parser.parse_args(argv)
+
+    metrics = evaluate(
+        args.checkpoint, args.corpus, args.output,
+        tokenizer_name=args.tokenizer,
+        batch_size=args.batch_size,
+        limit=args.limit,
+        workers=args.workers,
+        cache_file=args.cache_file,
+        index_file=args.index,
+        threshold=args.threshold,
+        verbose=True,
+    )
+    print(json.dumps(metrics, indent=2))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
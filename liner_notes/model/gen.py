@@ -1,59 +1,110 @@
+import os
+
 import torch
-from datasets import load_dataset, load_metric
-from transformers import BertTokenizer, EncoderDecoderModel
+from transformers import BertTokenizerFast
+
+from liner_notes.model.cache import GenerationCache, checkpoint_identity, generation_params
+from liner_notes.model.quantize import is_quantized, load_checkpoint
+from liner_notes.model.scoring import RougeScorer
+from liner_notes.model.tokenized import load_tokenized
 
 
 batch_size = 64  # 16 or change to 64 for full evaluation
 encoder_max_length = 128
+padding = 'longest'  # pad each batch to its longest name, or 'max_length'
 decoder_max_length = 512
 device = 'cuda' if torch.cuda.is_available() else 'cpu'
 
-tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
-ed_model = EncoderDecoderModel.from_pretrained('./checkpoint-1500')
+tokenizer = BertTokenizerFast.from_pretrained('bert-base-uncased')
+checkpoint = './checkpoint-1500'  # or an int8 export, see quantize.py
+if is_quantized(checkpoint):
+    device = 'cpu'  # int8 kernels are CPU only
+ed_model = load_checkpoint(checkpoint)
 ed_model.to(device)
 
-csv_file = '../data/foo.csv'
-test_data = load_dataset(
-    'csv',
-    data_files=csv_file,
-    split='train',
-)
+# descriptions keyed by normalized label, checkpoint and generation config
+# set cache_file to keep them across runs as well
+cache_file = None
+cache = GenerationCache(checkpoint_identity(checkpoint), generation_params(ed_model),
+                        path=cache_file)
+
+
+def tokenize_names(batch):
+    # Tokenizer will automatically set [BOS] <text> [EOS]
+    # cut off at BERT max length, padded later per batch
+    inputs = tokenizer(batch['name'], truncation=True, max_length=encoder_max_length)
+    batch['input_ids'] = inputs.input_ids
+    batch['attention_mask'] = inputs.attention_mask
+    return batch
+
+
+# '.csv', '.parquet' or memory-mapped '.arrow' from garagiste.clean
+# tokenized once, later runs read the cached Arrow in ./tokenized
+corpus_file = '../data/foo.csv'
+test_data = load_tokenized(corpus_file, 'train', tokenize_names, tokenizer,
+                           encoder_max_length=encoder_max_length)
 # only use 16 training examples for notebook - COMMENT LINE FOR FULL TRAINING
 #test_data = test_data.select(range(16))
-test_data = test_data.select(range(3))
+# large test sets: python -m liner_notes.model.evaluate streams the corpus,
+# appends predictions batch by batch and resumes after an interruption
 
 
-# load rouge for validation
-rouge = load_metric('rouge')
+# rouge for validation -- scored in chunks on a worker pool
+rouge = RougeScorer(['rouge2'], workers=os.cpu_count())
 
 
 # map data correctly
 def generate_description(batch):
-    # Tokenizer will automatically set [BOS] <text> [EOS]
-    # cut off at BERT max length
-    inputs = tokenizer(batch['name'], padding='max_length', truncation=True,
-                       max_length=encoder_max_length, return_tensors='pt')
-    input_ids = inputs.input_ids.to(device)
-    attention_mask = inputs.attention_mask.to(device)
+    rows = {name: i for i, name in enumerate(batch['name'])}
 
-    outputs = ed_model.generate(input_ids, attention_mask=attention_mask)
+    def generate(names):
+        # only the labels missing from the cache reach the model
+        features = {
+            'input_ids': [batch['input_ids'][rows[name]] for name in names],
+            'attention_mask': [batch['attention_mask'][rows[name]] for name in names],
+        }
+        inputs = tokenizer.pad(features, padding=padding, max_length=encoder_max_length,
+                               return_tensors='pt')
+        input_ids = inputs.input_ids.to(device)
+        attention_mask = inputs.attention_mask.to(device)
 
-    # all special tokens including will be removed
-    output_str = tokenizer.batch_decode(outputs, skip_special_tokens=True)
+        outputs = ed_model.generate(input_ids, attention_mask=attention_mask)
 
-    batch['pred'] = output_str
+        # all special tokens including will be removed
+        return tokenizer.batch_decode(outputs, skip_special_tokens=True)
+
+    batch['pred'] = cache.describe(batch['name'], generate)
 
     return batch
 
 
+# bucket names of similar tokenized length into the same batch ...
+lengths = [len(ids) for ids in test_data['input_ids']]
+order = sorted(range(len(lengths)), key=lengths.__getitem__)
+test_data = test_data.select(order)
+
 #results = test_data.map(generate_description, batched=True, batch_size=batch_size, remove_columns=['name'])
 results = test_data.map(generate_description, batched=True, batch_size=batch_size)
+
+# ... and put the results back in corpus order
+inverse = [0] * len(order)
+for position, i in enumerate(order):
+    inverse[i] = position
+results = results.select(inverse)
+
 name_str = results['name']
 note_str = results['note']
 pred_str = results['pred']
 
-rouge_output = rouge.compute(predictions=pred_str, references=note_str, rouge_types=['rouge2'])['rouge2'].mid
+# scored here, not inside the map -- a later run with the same data reads
+# the map's result from the datasets cache without calling it
+for i in range(0, len(pred_str), batch_size):
+    rouge.add(pred_str[i:i + batch_size], note_str[i:i + batch_size])
+
+rouge_output = rouge.compute()['rouge2'].mid
+rouge.close()
 print(rouge_output)
+print(cache.stats())
 print()
 
 for name, note in zip(name_str, pred_str):
@@ -0,0 +1,253 @@
+"""Export an int8 dynamically quantized copy of an EncoderDecoderModel checkpoint
+
+Quantize, then compare against the fp32 checkpoint:
+
+    python -m liner_notes.model.quantize ./checkpoint-1500 ./checkpoint-1500-int8 \
+        --corpus ../data/garagiste_wine_clean.arrow --report int8.json
+
+"""
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import torch
+from torch.ao.nn.quantized.dynamic import Linear as DynamicLinear
+from torch.ao.quantization import quantize_dynamic
+from transformers import EncoderDecoderConfig, EncoderDecoderModel, GenerationConfig
+
+try:
+    from transformers.initialization import no_init_weights  # transformers 5
+except ImportError:
+    from transformers.modeling_utils import no_init_weights
+
+# written beside config.json -- its presence marks a quantized checkpoint
+QUANTIZED_WEIGHTS = 'quantized.pt'
+
+
+def is_quantized(checkpoint):
+    return os.path.isfile(os.path.join(os.path.expanduser(checkpoint), QUANTIZED_WEIGHTS))
+
+
+def quantize(ed_model, inplace=False):
+    """int8 copy of ed_model with every nn.Linear dynamically quantized.
+
+    Weights are stored as int8 and activations quantized on the fly, so
+    no calibration data is needed.  CPU only.  inplace=True swaps the
+    layers of ed_model itself instead of quantizing a deep copy.
+
+    """
+    ed_model = ed_model.to('cpu').eval()
+    return quantize_dynamic(ed_model, {torch.nn.Linear}, dtype=torch.qint8, inplace=inplace)
+
+
+def empty_quantized(config):
+    # the module tree quantize() produces, without ever filling fp32
+    # weights: torch and transformers initialization is skipped, and each
+    # nn.Linear is swapped for an empty int8 one before its (untouched,
+    # so never resident) fp32 weight is read
+    with no_init_weights():
+        ed_model = EncoderDecoderModel(config=config)
+
+    for module in list(ed_model.modules()):
+        for name, child in module.named_children():
+            # exact type, like quantize_dynamic's {nn.Linear} spec
+            if type(child) is torch.nn.Linear:
+                setattr(module, name, DynamicLinear(
+                    child.in_features, child.out_features,
+                    bias_=child.bias is not None, dtype=torch.qint8,
+                ))
+
+    return ed_model.eval()
+
+
+def export(checkpoint, output):
+    """Write an int8 copy of checkpoint to the output directory.
+
+    Quantized modules cannot go through save_pretrained, so the config
+    is saved as usual and the quantized state dict as QUANTIZED_WEIGHTS.
+    Use load_checkpoint to read it back.
+
+    """
+    ed_model = EncoderDecoderModel.from_pretrained(checkpoint)
+    q_model = quantize(ed_model)
+
+    os.makedirs(output, exist_ok=True)
+    ed_model.config.save_pretrained(output)
+    ed_model.generation_config.save_pretrained(output)
+    torch.save(q_model.state_dict(), os.path.join(output, QUANTIZED_WEIGHTS))
+
+    return q_model
+
+
+def load_checkpoint(checkpoint):
+    """EncoderDecoderModel from an fp32 or int8 checkpoint directory."""
+    if not is_quantized(checkpoint):
+        return EncoderDecoderModel.from_pretrained(checkpoint)
+
+    # an empty int8 model, then the saved weights -- peak memory stays
+    # near the int8 size instead of a full fp32 model plus a copy
+    ed_model = empty_quantized(EncoderDecoderConfig.from_pretrained(checkpoint))
+    # the state dict is only tensors, quantized tensors, tuples and dtypes,
+    # so it loads without unpickling arbitrary objects from the directory
+    state = torch.load(os.path.join(checkpoint, QUANTIZED_WEIGHTS), weights_only=True)
+    ed_model.load_state_dict(state)
+    del state
+
+    if os.path.isfile(os.path.join(checkpoint, 'generation_config.json')):
+        ed_model.generation_config = GenerationConfig.from_pretrained(checkpoint)
+
+    return ed_model.eval()
+
+
+def model_bytes(ed_model):
+    # serialized size of the weights, packed int8 included
+    buf = io.BytesIO()
+    torch.save(ed_model.state_dict(), buf)
+    return buf.tell()
+
+
+def memory_kib():
+    # (current, peak) resident set size from /proc, None where missing
+    try:
+        with open('/proc/self/status') as f:
+            status = dict(line.split(':', 1) for line in f)
+        return int(status['VmRSS'].split()[0]), int(status['VmHWM'].split()[0])
+    except OSError:
+        return None, None
+
+
+def _load_memory(checkpoint):
+    # run in a fresh process, with torch and transformers already imported
+    try:
+        # '5' resets the peak (VmHWM), else importing torch may be the peak
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+    rss, _ = memory_kib()
+    ed_model = load_checkpoint(checkpoint)  # noqa: F841 -- kept resident while measured
+    after, peak = memory_kib()
+
+    if rss is None:
+        return {'load_peak_rss_kib': None, 'resident_rss_kib': None}
+
+    return {
+        'load_peak_rss_kib': peak - rss,
+        'resident_rss_kib': after - rss,
+    }
+
+
+def load_memory(checkpoint):
+    """Peak and resident RSS growth from loading checkpoint, in its own process.
+
+    Measuring in this process would only see growth beyond whatever was
+    loaded before, so each checkpoint gets a fresh interpreter.
+
+    """
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1) as pool:
+        return pool.apply(_load_memory, (checkpoint,))
+
+
+def measure(ed_model, tokenizer, names, notes, batch_size=16, **generate_kwargs):
+    # labels/sec, generated tokens/sec and mean ROUGE-2 F of one model
+    from liner_notes.model.describe import describe
+    from liner_notes.model.scoring import score_pairs
+
+    start = time.perf_counter()
+    preds = describe(names, tokenizer, ed_model, batch_size=batch_size, **generate_kwargs)
+    elapsed = time.perf_counter() - start
+
+    tokens = sum(len(ids) for ids in tokenizer(preds, add_special_tokens=False).input_ids)
+    scores = score_pairs(preds, notes, rouge_types=('rouge2',))
+
+    return {
+        'seconds': elapsed,
+        'labels_per_sec': len(names) / elapsed,
+        'tokens_per_sec': tokens / elapsed,
+        'rouge2_fmeasure': float(scores[:, 0, 2].mean()),
+        'model_bytes': model_bytes(ed_model),
+    }
+
+
+def compare(checkpoint, quantized, tokenizer, names, notes, **kwargs):
+    """Latency, size, RSS and ROUGE-2 of an fp32 and an int8 checkpoint.
+
+    Returns
+    -------
+    report : dict
+        'fp32' and 'int8' measurements plus the int8 - fp32 ROUGE-2 delta
+        and the speed-up and size ratios
+
+    """
+    report = {'samples': len(names)}
+
+    for name, path in (('fp32', checkpoint), ('int8', quantized)):
+        ed_model = load_checkpoint(path)
+        report[name] = measure(ed_model, tokenizer, names, notes, **kwargs)
+        report[name].update(load_memory(path))
+        del ed_model
+
+    report['rouge2_delta'] = report['int8']['rouge2_fmeasure'] - report['fp32']['rouge2_fmeasure']
+    report['speedup'] = report['int8']['labels_per_sec'] / report['fp32']['labels_per_sec']
+    report['size_ratio'] = report['int8']['model_bytes'] / report['fp32']['model_bytes']
+
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('checkpoint', help='fp32 checkpoint directory')
+    parser.add_argument('output', help='directory for the int8 checkpoint')
+    parser.add_argument('--tokenizer', default='bert-base-uncased')
+    parser.add_argument('--corpus', help='cleaned corpus to compare the two models on')
+    parser.add_argument('--split', default='train[90%:]')
+    parser.add_argument('--samples', type=int, default=64)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--report', help='write the comparison as JSON')
+    args = parser.parse_args(argv)
+
+    export(args.checkpoint, args.output)
+    print(f'wrote {args.output}')
+
+    if not args.corpus:
+        return 0
+
+    from transformers import BertTokenizerFast
+
+    from liner_notes.model.corpus import load_corpus
+
+    tokenizer = BertTokenizerFast.from_pretrained(args.tokenizer)
+    data = load_corpus(args.corpus, split=args.split)
+    data = data.select(range(min(args.samples, len(data))))
+
+    # both models run on the CPU, where the int8 model is meant to serve
+    report = compare(args.checkpoint, args.output, tokenizer,
+                     list(data['name']), list(data['note']), batch_size=args.batch_size)
+
+    for name in ('fp32', 'int8'):
+        r = report[name]
+        # None off Linux, where /proc/self/status is missing
+        peak = r['load_peak_rss_kib']
+        peak = f'{peak / 1024:8.1f} MiB' if peak is not None else f"{'-':>8}"
+        print(f"{name}  {r['labels_per_sec']:8.2f} labels/s  "
+              f"{r['model_bytes'] / 2**20:8.1f} MiB  load peak {peak}  "
+              f"rouge2 {r['rouge2_fmeasure']:.4f}")
+    print(f"speedup {report['speedup']:.2f}x  size {report['size_ratio']:.2f}x  "
+          f"rouge2 delta {report['rouge2_delta']:+.4f}")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
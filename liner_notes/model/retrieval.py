@@ -0,0 +1,254 @@
+"""Answer known labels from the cleaned corpus before generating
+
+A character-trigram TF-IDF index over the corpus names, built once and
+saved as a single .npz:
+
+    python -m liner_notes.model.retrieval build ../data/garagiste_wine_clean.arrow names.npz
+    python -m liner_notes.model.retrieval query names.npz '2009 charvin chateauneuf du pape'
+
+"""
+
+import argparse
+import collections
+import math
+import sys
+import threading
+import time
+
+import numpy as np
+
+from liner_notes.data.garagiste import normalize_label
+
+
+def trigrams(name):
+    """Character trigram counts of a normalized name, padded with spaces."""
+    s = f' {normalize_label(name)} '
+    return collections.Counter(s[i:i + 3] for i in range(len(s) - 2))
+
+
+def pack(strings):
+    # utf-8 blob plus offsets -- no pickled objects in the .npz
+    encoded = [s.encode() for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def unpack(blob, offsets, i):
+    return blob[offsets[i]:offsets[i + 1]].tobytes().decode()
+
+
+class RetrievalIndex:
+    """Inverted index of TF-IDF weighted character trigrams of names.
+
+    Cosine similarity between a query and every name sharing a trigram
+    with it is accumulated from the postings, so a lookup only touches
+    names that could match.
+
+    Parameters
+    ----------
+    vocab : dict
+        trigram -> row of the postings
+    idf : numpy.ndarray
+    indptr, docs, weights : numpy.ndarray
+        postings in CSR form: docs[indptr[t]:indptr[t + 1]] hold the
+        names containing trigram t, weights their normalized TF-IDF
+    names, notes : (blob, offsets) pairs
+        the corpus, see pack()
+
+    Example
+    -------
+    >>> index = RetrievalIndex.build(data['name'], data['note'])
+    >>> index.save('names.npz')
+    >>> index = RetrievalIndex.load('names.npz')
+    >>> index.search('2009 Charvin Chateauneuf-du-Pape', k=1)
+    [(0.97, '2009 charvin chateauneuf du pape', 'dark fruit, garrigue ...')]
+
+    """
+
+    def __init__(self, vocab, idf, indptr, docs, weights, names, notes):
+        self.vocab = vocab
+        self.idf = idf
+        self.indptr = indptr
+        self.docs = docs
+        self.weights = weights
+        self.names = names
+        self.notes = notes
+        self.size = len(names[1]) - 1
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def build(cls, names, notes):
+        names = list(names)
+        notes = list(notes)
+        grams = [trigrams(name) for name in names]
+
+        df = collections.Counter()
+        for counts in grams:
+            df.update(counts.keys())
+
+        vocab = {gram: i for i, gram in enumerate(sorted(df))}
+        idf = np.array([math.log((1 + len(names)) / (1 + df[g])) + 1 for g in sorted(df)])
+
+        postings = [[] for _ in vocab]
+        for doc, counts in enumerate(grams):
+            ids = [vocab[g] for g in counts]
+            w = np.array([counts[g] for g in counts], dtype=float) * idf[ids]
+            w /= np.linalg.norm(w) or 1.0
+            for t, weight in zip(ids, w):
+                postings[t].append((doc, weight))
+
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum([len(p) for p in postings], out=indptr[1:])
+        docs = np.array([d for p in postings for d, _ in p], dtype=np.int32)
+        weights = np.array([w for p in postings for _, w in p], dtype=np.float32)
+
+        return cls(vocab, idf, indptr, docs, weights, pack(names), pack(notes))
+
+    def save(self, path):
+        grams, _ = pack(sorted(self.vocab, key=self.vocab.get))
+        np.savez(
+            path,
+            grams=grams,
+            idf=self.idf,
+            indptr=self.indptr,
+            docs=self.docs,
+            weights=self.weights,
+            names=self.names[0],
+            name_offsets=self.names[1],
+            notes=self.notes[0],
+            note_offsets=self.notes[1],
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            # every trigram is 3 characters but not always 3 bytes
+            text = f['grams'].tobytes().decode()
+            vocab = {text[i:i + 3]: n for n, i in enumerate(range(0, len(text), 3))}
+            return cls(
+                vocab, f['idf'], f['indptr'], f['docs'], f['weights'],
+                (f['names'], f['name_offsets']), (f['notes'], f['note_offsets']),
+            )
+
+    def scores(self, name):
+        """Cosine similarity of name to every corpus name."""
+        counts = trigrams(name)
+        ids = [self.vocab[g] for g in counts if g in self.vocab]
+        scores = np.zeros(self.size)
+        if not ids:
+            return scores
+
+        # unknown trigrams still count towards the query's norm
+        q = np.array([counts[g] for g in counts], dtype=float)
+        known = np.array([g in self.vocab for g in counts])
+        q[known] *= self.idf[ids]
+        q[~known] *= self.idf.max()
+        q /= np.linalg.norm(q)
+
+        starts, stops = self.indptr[ids], self.indptr[np.array(ids) + 1]
+        docs = np.concatenate([self.docs[a:b] for a, b in zip(starts, stops)])
+        weights = np.concatenate([
+            self.weights[a:b] * w for a, b, w in zip(starts, stops, q[known])
+        ])
+        return np.bincount(docs, weights=weights, minlength=self.size)
+
+    def search(self, name, k=5):
+        """The k nearest corpus entries as (score, name, note), best first."""
+        scores = self.scores(name)
+        k = min(k, self.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            (float(scores[i]), unpack(*self.names, i), unpack(*self.notes, i))
+            for i in top if scores[i] > 0
+        ]
+
+    def lookup(self, name, threshold=0.9):
+        """Note of the best match scoring at least threshold, else None."""
+        best = self.search(name, k=1)
+        found = best and best[0][0] >= threshold
+        with self.lock:
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return best[0][2] if found else None
+
+    def describe(self, names, func, threshold=0.9):
+        """Describe names from the index, only running func on the misses.
+
+        Parameters
+        ----------
+        names : sequence
+        func : callable
+            maps a list of names to a list of descriptions
+        threshold : float, default 0.9
+            cosine similarity a match needs to be used
+
+        Returns
+        -------
+        descriptions : list
+            in the same order as names
+
+        """
+        names = list(names)
+        found = [self.lookup(name, threshold) for name in names]
+        todo = [i for i, note in enumerate(found) if note is None]
+
+        if todo:
+            for i, description in zip(todo, func([names[i] for i in todo])):
+                found[i] = description
+
+        return found
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else None,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help='index the names of a cleaned corpus')
+    build.add_argument('corpus')
+    build.add_argument('index', help='.npz to write')
+    build.add_argument('--split', default='train')
+
+    query = commands.add_parser('query', help='nearest corpus entries of a label')
+    query.add_argument('index')
+    query.add_argument('name')
+    query.add_argument('-k', type=int, default=5)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        from liner_notes.model.corpus import load_corpus
+
+        data = load_corpus(args.corpus, split=args.split)
+        start = time.perf_counter()
+        index = RetrievalIndex.build(data['name'], data['note'])
+        index.save(args.index)
+        print(f'indexed {index.size} names in {time.perf_counter() - start:.2f}s')
+    else:
+        index = RetrievalIndex.load(args.index)
+        start = time.perf_counter()
+        results = index.search(args.name, k=args.k)
+        elapsed = time.perf_counter() - start
+        for score, name, note in results:
+            print(f'{score:.3f}  {name}\n       {note[:100]}')
+        print(f'{elapsed * 1000:.2f} ms')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
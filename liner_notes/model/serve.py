@@ -0,0 +1,303 @@
+"""Long-running generation service with dynamic request batching
+
+Keeps the tokenizer and model resident and answers over HTTP:
+
+    POST /generate  {"name": "..."} or {"names": ["...", ...]}
+    GET  /stats     latency and batch-size statistics
+
+"""
+
+import argparse
+import collections
+import json
+import queue
+import statistics
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from liner_notes.model.cache import GenerationCache, checkpoint_identity, generation_params
+from liner_notes.model.retrieval import RetrievalIndex
+
+
+class Stats:
+    """Per-request latency and per-batch size statistics.
+
+    Parameters
+    ----------
+    window : int, default 10000
+        number of most recent latencies kept for the percentiles
+
+    """
+
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.latencies = collections.deque(maxlen=window)
+        self.batch_sizes = collections.Counter()
+        self.requests = 0
+        self.errors = 0
+
+    def record(self, latencies, error=False):
+        with self.lock:
+            self.latencies.extend(latencies)
+            self.batch_sizes[len(latencies)] += 1
+            self.requests += len(latencies)
+            self.errors += len(latencies) if error else 0
+
+    def report(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            batch_sizes = dict(sorted(self.batch_sizes.items()))
+            requests, errors = self.requests, self.errors
+
+        def percentile(q):
+            if not latencies:
+                return None
+            return latencies[min(int(q * len(latencies)), len(latencies) - 1)]
+
+        batches = sum(batch_sizes.values())
+        return {
+            'requests': requests,
+            'errors': errors,
+            'batches': batches,
+            'mean_batch_size': requests / batches if batches else None,
+            'batch_sizes': batch_sizes,
+            'latency_mean': statistics.fmean(latencies) if latencies else None,
+            'latency_p50': percentile(0.50),
+            'latency_p90': percentile(0.90),
+            'latency_p99': percentile(0.99),
+        }
+
+
+class Batcher:
+    """Collect concurrent requests into batches for a single worker thread.
+
+    A batch is run as soon as it holds max_batch_size requests, or
+    max_wait seconds after its first request arrived, whichever is
+    first.
+
+    Parameters
+    ----------
+    func : callable
+        maps a list of inputs to a list of outputs, e.g. describe.describe
+        with the model bound
+    max_batch_size : int, default 16
+    max_wait : float, default 0.01
+        seconds to wait for more requests before running a batch
+    stats : Stats, default None
+
+    Example
+    -------
+    >>> batcher = Batcher(lambda names: [n.upper() for n in names])
+    >>> batcher.submit('1999 chevillon').result()
+    '1999 CHEVILLON'
+
+    """
+
+    def __init__(self, func, max_batch_size=16, max_wait=0.01, stats=None):
+        self.func = func
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.stats = stats or Stats()
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, item):
+        future = Future()
+        self.queue.put((item, future, time.perf_counter()))
+        return future
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            items = [item for item, _, _ in batch]
+
+            try:
+                outputs = list(self.func(items))
+                if len(outputs) != len(items):
+                    # zip would leave the callers past the end waiting forever
+                    raise RuntimeError(f'{len(outputs)} outputs for a batch of {len(items)}')
+            except Exception as e:  # hand the error to every caller
+                now = time.perf_counter()
+                self.stats.record([now - t for _, _, t in batch], error=True)
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            now = time.perf_counter()
+            self.stats.record([now - t for _, _, t in batch])
+            for (_, future, _), output in zip(batch, outputs):
+                future.set_result(output)
+
+
+def make_handler(batcher, cache=None, index=None, threshold=0.9):
+
+    def generate(names):
+        futures = [batcher.submit(name) for name in names]
+        return [future.result() for future in futures]
+
+    def cached(names):
+        # cached labels are answered without waiting for a batch
+        if cache is None:
+            return generate(names)
+        return cache.describe(names, generate)
+
+    def lookup(names):
+        # labels already in the corpus are answered from the index
+        if index is None:
+            return cached(names)
+        return index.describe(names, cached, threshold)
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _send(self, code, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path != '/stats':
+                return self._send(404, {'error': 'not found'})
+            report = batcher.stats.report()
+            if cache is not None:
+                report['cache'] = cache.stats()
+            if index is not None:
+                report['index'] = index.stats()
+            self._send(200, report)
+
+        def do_POST(self):
+            if self.path != '/generate':
+                return self._send(404, {'error': 'not found'})
+
+            start = time.perf_counter()
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                request = json.loads(self.rfile.read(length))
+                names = request['names'] if 'names' in request else [request['name']]
+                # checked here -- one bad label in a shared batch would
+                # fail every request batched with it
+                if (not isinstance(names, list) or not names
+                        or not all(isinstance(name, str) for name in names)):
+                    raise TypeError(names)
+            except (ValueError, KeyError, TypeError):
+                return self._send(400, {'error': 'expected {"name": "..."} or {"names": ["...", ...]}'})
+
+            try:
+                descriptions = lookup(names)
+            except Exception as e:
+                return self._send(500, {'error': str(e)})
+
+            self._send(200, {
+                'descriptions': descriptions,
+                'latency': time.perf_counter() - start,
+            })
+
+        def log_message(self, format, *args):
+            pass  # keep stdout quiet, /stats has the numbers
+
+    return Handler
+
+
+def serve(checkpoint='./checkpoint-500', tokenizer_name='bert-base-uncased',
+          host='127.0.0.1', port=8000, max_batch_size=16, max_wait=0.01,
+          cache_size=10000, cache_file=None, index_file=None, threshold=0.9):
+    """Load the model once and serve generation requests until killed.
+
+    Parameters
+    ----------
+    checkpoint : string, default './checkpoint-500'
+    tokenizer_name : string, default 'bert-base-uncased'
+    host : string, default '127.0.0.1'
+    port : int, default 8000
+    max_batch_size : int, default 16
+        most labels passed to one generate() call
+    max_wait : float, default 0.01
+        seconds a request may wait for others to join its batch
+    cache_size : int, default 10000
+        descriptions kept in memory, 0 disables the cache
+    cache_file : string, default None
+        SQLite file keeping descriptions across restarts
+    index_file : string, default None
+        retrieval index of the cleaned corpus, see retrieval.py
+    threshold : float, default 0.9
+        similarity at which an indexed note is returned instead
+
+    """
+    from liner_notes.model import describe
+
+    tokenizer, ed_model = describe.load_model(checkpoint, tokenizer_name)
+
+    def generate(names):
+        return describe.describe(names, tokenizer, ed_model)
+
+    cache = None
+    if cache_size:
+        cache = GenerationCache(
+            checkpoint_identity(checkpoint),
+            generation_params(ed_model),
+            maxsize=cache_size,
+            path=cache_file,
+        )
+
+    index = RetrievalIndex.load(index_file) if index_file else None
+
+    batcher = Batcher(generate, max_batch_size=max_batch_size, max_wait=max_wait)
+    handler = make_handler(batcher, cache, index, threshold)
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f'serving {checkpoint} on http://{host}:{port}')
+    server.serve_forever()
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description=__doc__.splitlines()[0])
+    parser.add_argument('--checkpoint', default='./checkpoint-500')
+    parser.add_argument('--tokenizer', default='bert-base-uncased')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-batch-size', type=int, default=16)
+    parser.add_argument('--max-wait', type=float, default=10.0,
+                        help='milliseconds to wait for a batch to fill')
+    parser.add_argument('--cache-size', type=int, default=10000,
+                        help='descriptions cached in memory, 0 to disable')
+    parser.add_argument('--cache-file', help='SQLite file for a persistent cache')
+    parser.add_argument('--index', help='retrieval index answering known labels')
+    parser.add_argument('--threshold', type=float, default=0.9,
+                        help='similarity an indexed label needs to be used')
+    args = parser.parse_args(argv)
+
+    serve(
+        checkpoint=args.checkpoint,
+        tokenizer_name=args.tokenizer,
+        host=args.host,
+        port=args.port,
+        max_batch_size=args.max_batch_size,
+        max_wait=args.max_wait / 1000,
+        cache_size=args.cache_size,
+        cache_file=args.cache_file,
+        index_file=args.index,
+        threshold=args.threshold,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+"""Sharded batch generation -- one model replica per worker process
+
+Backfill descriptions for a whole catalog with the cores split between
+worker processes, each generating its own share of the names:
+
+    python -m liner_notes.model.shard ./checkpoint-1500 catalog.csv descriptions.csv --workers 8
+    python -m liner_notes.model.shard ./checkpoint-1500 catalog.csv --benchmark 512
+
+"""
+
+import argparse
+import csv
+import itertools
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# set by _init in each worker
+_state = {}
+
+
+def _init(checkpoint, tokenizer_name, threads, batch_size, generate_kwargs):
+    import torch
+
+    from liner_notes.model.describe import load_model
+
+    torch.set_num_threads(threads)
+    tokenizer, ed_model = load_model(checkpoint, tokenizer_name)
+    _state.update(tokenizer=tokenizer, ed_model=ed_model, batch_size=batch_size,
+                  generate_kwargs=generate_kwargs)
+
+
+def _generation_params():
+    from liner_notes.model.cache import generation_params
+
+    return generation_params(_state['ed_model'], **_state['generate_kwargs'])
+
+
+def _describe(names):
+    from liner_notes.model.describe import describe
+
+    return describe(names, _state['tokenizer'], _state['ed_model'], _state['batch_size'],
+                    **_state['generate_kwargs'])
+
+
+class ShardedDescriber:
+    """Describe names on a pool of processes, each holding a model replica.
+
+    Names are cut into chunks of chunksize and handed out to whichever
+    worker is free.  Every worker runs torch with threads intra-op
+    threads, so small beam-search batches keep all their cores busy
+    instead of one process stalling on synchronization between many.
+    Descriptions come back in input order.
+
+    Parameters
+    ----------
+    checkpoint : string
+        fp32 or int8 checkpoint directory
+    tokenizer_name : string, default 'bert-base-uncased'
+    workers : int, default None
+        worker processes, None uses one per core
+    threads : int, default None
+        torch threads per worker, None splits the cores evenly
+    batch_size : int, default 64
+        names per generate() call in a worker
+    chunksize : int, default 256
+        names sent to a worker at a time
+    **generate_kwargs
+        passed on to ed_model.generate, e.g. num_beams=4
+
+    Example
+    -------
+    >>> with ShardedDescriber('./checkpoint-1500', workers=8) as describer:
+    ...     for name, description in zip(names, describer.imap(names)):
+    ...         print(name, description)
+
+    """
+
+    def __init__(self, checkpoint, tokenizer_name='bert-base-uncased', workers=None,
+                 threads=None, batch_size=64, chunksize=256, **generate_kwargs):
+        cores = os.cpu_count() or 1
+        self.workers = workers or cores
+        self.threads = threads or max(1, cores // self.workers)
+        self.chunksize = chunksize
+
+        # 'spawn' -- workers start with a fresh torch thread pool
+        context = multiprocessing.get_context('spawn')
+        self.pool = ProcessPoolExecutor(
+            self.workers, mp_context=context, initializer=_init,
+            initargs=(checkpoint, tokenizer_name, self.threads, batch_size, generate_kwargs),
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.pool.shutdown()
+
+    def __call__(self, names):
+        return list(self.imap(names))
+
+    def generation_params(self):
+        """cache.generation_params of the workers' model, for cache keys."""
+        return self.pool.submit(_generation_params).result()
+
+    def imap(self, names):
+        """Yield a description for every name, in order, as chunks finish.
+
+        At most two chunks per worker are in flight, so names can be a
+        generator over a catalog larger than memory.
+
+        """
+        names = iter(names)
+        window = 2 * self.workers
+        pending = deque()
+
+        while True:
+            chunk = list(itertools.islice(names, self.chunksize))
+            if chunk:
+                pending.append(self.pool.submit(_describe, chunk))
+            if pending and (len(pending) >= window or not chunk):
+                yield from pending.popleft().result()
+            elif not chunk:
+                return
+
+
+def read_names(path, limit=None):
+    """Yield the name column of a '.csv', '.parquet' or '.arrow' file."""
+    from liner_notes.model.evaluate import read_columns
+
+    names = (name for chunk, in read_columns(path, columns=['name']) for name in chunk)
+    return itertools.islice(names, limit)
+
+
+def backfill(checkpoint, infile, outfile, tokenizer_name='bert-base-uncased', workers=None,
+             threads=None, batch_size=64, chunksize=256, limit=None, cache_file=None,
+             index_file=None, threshold=0.9, verbose=False, **generate_kwargs):
+    """Write a name, description CSV for every name of infile.
+
+    Like evaluate.py, labels are looked up in the retrieval index first,
+    then in the generation cache, and only the rest reach the workers.
+    Rows are written in input order, a window of two chunks per worker
+    at a time.
+
+    Parameters
+    ----------
+    cache_file : string, default None
+        SQLite generation cache, see cache.GenerationCache
+    index_file : string, default None
+        retrieval index consulted before generating, see retrieval.py
+    threshold : float, default 0.9
+        similarity an indexed label needs to be used
+
+    The other parameters are those of ShardedDescriber.
+
+    Returns
+    -------
+    rows : int
+
+    """
+    from liner_notes.model.cache import GenerationCache, checkpoint_identity
+    from liner_notes.model.retrieval import RetrievalIndex
+
+    start = time.perf_counter()
+    rows = 0
+
+    index = RetrievalIndex.load(index_file) if index_file else None
+
+    with ShardedDescriber(checkpoint, tokenizer_name, workers, threads, batch_size,
+                          chunksize, **generate_kwargs) as describer:
+        cache = GenerationCache(checkpoint_identity(checkpoint), describer.generation_params(),
+                                path=cache_file)
+
+        def describe(names):
+            if index is not None:
+                return index.describe(names, lambda misses: cache.describe(misses, describer),
+                                      threshold)
+            return cache.describe(names, describer)
+
+        with cache, open(os.path.expanduser(outfile), 'w', newline='') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(['name', 'description'])
+
+            # enough misses per window to keep every worker busy
+            names = read_names(infile, limit)
+            window = 2 * describer.workers * chunksize
+            while True:
+                chunk = list(itertools.islice(names, window))
+                if not chunk:
+                    break
+                writer.writerows(zip(chunk, describe(chunk)))
+                rows += len(chunk)
+                if verbose:
+                    rate = rows / (time.perf_counter() - start)
+                    print(f'{rows} rows  {rate:.2f} labels/s')
+
+        if verbose:
+            print(f'cache {cache.stats()}')
+            if index is not None:
+                print(f'index {index.stats()}')
+
+    return rows
+
+
+def benchmark(checkpoint, names, tokenizer_name='bert-base-uncased', workers=None,
+              threads=None, batch_size=64, chunksize=256, **generate_kwargs):
+    """Labels/sec of single-process generation against the sharded pool.
+
+    The single process uses torch's default threading.  Model loading is
+    excluded from both timings (the pool is warmed up on one name per
+    worker first).  Beam search over differently composed batches and
+    thread counts may break near-ties differently, so descriptions that
+    differ between the two modes are counted, not treated as an error.
+
+    Returns
+    -------
+    report : dict
+
+    """
+    import torch
+
+    from liner_notes.model.describe import describe, load_model
+
+    names = list(names)
+
+    tokenizer, ed_model = load_model(checkpoint, tokenizer_name)
+    start = time.perf_counter()
+    expected = describe(names, tokenizer, ed_model, batch_size, **generate_kwargs)
+    single = time.perf_counter() - start
+
+    with ShardedDescriber(checkpoint, tokenizer_name, workers, threads, batch_size,
+                          chunksize, **generate_kwargs) as describer:
+        # one name per worker, so every replica is loaded before timing
+        list(describer.pool.map(_describe, [names[:1]] * describer.workers))
+        start = time.perf_counter()
+        found = describer(names)
+        sharded = time.perf_counter() - start
+
+    return {
+        'labels': len(names),
+        'mismatches': sum(a != b for a, b in zip(found, expected)),
+        'single_threads': torch.get_num_threads(),
+        'single_labels_per_sec': len(names) / single,
+        'workers': describer.workers,
+        'threads_per_worker': describer.threads,
+        'sharded_labels_per_sec': len(names) / sharded,
+        'speedup': single / sharded,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('checkpoint')
+    parser.add_argument('infile', help="'.csv', '.parquet' or '.arrow' with a name column")
+    parser.add_argument('outfile', nargs='?', help='name, description CSV to write')
+    parser.add_argument('--tokenizer', default='bert-base-uncased')
+    parser.add_argument('--workers', type=int, help='processes, default one per core')
+    parser.add_argument('--threads', type=int, help='torch threads per worker')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--chunksize', type=int, default=256)
+    parser.add_argument('--num-beams', type=int)
+    parser.add_argument('--limit', type=int, help='only the first LIMIT names')
+    parser.add_argument('--cache-file', help='SQLite generation cache')
+    parser.add_argument('--index', help='retrieval index consulted before generating')
+    parser.add_argument('--threshold', type=float, default=0.9)
+    parser.add_argument('--benchmark', type=int, metavar='N',
+                        help='compare with single-process generation on N names')
+    args = parser.parse_args(argv)
+
+    generate_kwargs = {'num_beams': args.num_beams} if args.num_beams else {}
+    options = dict(
+        tokenizer_name=args.tokenizer,
+        workers=args.workers,
+        threads=args.threads,
+        batch_size=args.batch_size,
+        chunksize=args.chunksize,
+        **generate_kwargs,
+    )
+
+    if args.benchmark:
+        report = benchmark(args.checkpoint, read_names(args.infile, args.benchmark), **options)
+        print(f"single process  {report['single_threads']:>2} threads   "
+              f"{report['single_labels_per_sec']:9.2f} labels/s")
+        print(f"{report['workers']:>2} workers  x {report['threads_per_worker']:>2} threads   "
+              f"{report['sharded_labels_per_sec']:9.2f} labels/s  "
+              f"({report['speedup']:.2f}x)")
+        print(f"{report['mismatches']} of {report['labels']} descriptions differ")
+    elif args.outfile:
+        rows = backfill(args.checkpoint, args.infile, args.outfile, limit=args.limit,
+                        cache_file=args.cache_file, index_file=args.index,
+                        threshold=args.threshold, verbose=True, **options)
+        print(f'wrote {rows} rows to {args.outfile}')
+    else:
+        parser.error('give an outfile or --benchmark')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
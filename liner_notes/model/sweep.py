@@ -0,0 +1,219 @@
+"""Rank every checkpoint of a training run by ROUGE-2 on one evaluation set
+
+The evaluation set is tokenized once and shared with worker processes,
+each evaluating whole checkpoints with its own share of the CPU threads.
+Throughput is timed afterwards in a separate pass, one checkpoint at a
+time on every core and the same subset of names, so checkpoints compare
+fairly:
+
+    python -m liner_notes.model.sweep './checkpoint-*' ../data/test.csv --limit 500
+
+"""
+
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# set by _init in each worker
+_state = {}
+
+
+def checkpoints(pattern):
+    """Directories matching pattern, in step order (checkpoint-500 before -1000)."""
+    def step(path):
+        numbers = re.findall(r'\d+', os.path.basename(os.path.normpath(path)))
+        return (int(numbers[-1]) if numbers else -1, path)
+
+    return sorted((p for p in glob.glob(os.path.expanduser(pattern)) if os.path.isdir(p)), key=step)
+
+
+def _init(tokenizer, ids, notes, threads, batch_size):
+    import torch
+
+    torch.set_num_threads(threads)
+    _state.update(tokenizer=tokenizer, ids=ids, notes=notes, batch_size=batch_size)
+
+
+def _evaluate(checkpoint):
+    from liner_notes.model.describe import describe_ids
+    from liner_notes.model.quantize import load_checkpoint
+    from liner_notes.model.scoring import bootstrap, score_pairs
+
+    tokenizer = _state['tokenizer']
+    ed_model = load_checkpoint(checkpoint).to('cpu').eval()
+
+    preds = describe_ids(_state['ids'], tokenizer, ed_model, _state['batch_size'])
+    low, mid, high = bootstrap(score_pairs(preds, _state['notes'])[:, 0])
+
+    return {
+        'checkpoint': checkpoint,
+        'rouge2_precision': float(mid[0]),
+        'rouge2_recall': float(mid[1]),
+        'rouge2_fmeasure': float(mid[2]),
+        'rouge2_fmeasure_low': float(low[2]),
+        'rouge2_fmeasure_high': float(high[2]),
+    }
+
+
+def _throughput(checkpoint, rows):
+    from liner_notes.model.describe import describe_ids
+    from liner_notes.model.quantize import load_checkpoint
+
+    tokenizer = _state['tokenizer']
+    ids = _state['ids'][:rows]
+    ed_model = load_checkpoint(checkpoint).to('cpu').eval()
+
+    # warm-up, so one-off allocation and kernel selection are not timed
+    describe_ids(ids[:_state['batch_size']], tokenizer, ed_model, _state['batch_size'])
+
+    start = time.perf_counter()
+    preds = describe_ids(ids, tokenizer, ed_model, _state['batch_size'])
+    elapsed = time.perf_counter() - start
+
+    tokens = sum(len(seq) for seq in tokenizer(preds, add_special_tokens=False).input_ids)
+
+    return {
+        'seconds': elapsed,
+        'labels_per_sec': len(preds) / elapsed,
+        'tokens_per_sec': tokens / elapsed,
+    }
+
+
+def sweep(pattern, corpus, tokenizer_name='bert-base-uncased', split='train',
+          limit=None, workers=None, batch_size=64, timing_rows=256, verbose=False):
+    """Evaluate every checkpoint matching pattern, best ROUGE-2 F first.
+
+    Parameters
+    ----------
+    pattern : string
+        glob of checkpoint directories, e.g. './checkpoint-*'
+    corpus : string
+        evaluation corpus understood by corpus.load_corpus
+    tokenizer_name : string, default 'bert-base-uncased'
+    split : string, default 'train'
+        e.g. 'train[90%:]' for ed.py's validation split
+    limit : int, default None
+        only evaluate the first limit rows of the split
+    workers : int, default None
+        checkpoints evaluated at once, None fits as many as there are
+        checkpoints and cores; the cores are split evenly between them
+    batch_size : int, default 64
+    timing_rows : int, default 256
+        names generated per checkpoint in the throughput pass, which runs
+        each checkpoint alone with every core; 0 skips it
+    verbose : bool, default False
+        if True prints each checkpoint as it finishes
+
+    Returns
+    -------
+    results : list
+        one dict per checkpoint, ranked by rouge2_fmeasure
+
+    """
+    from transformers import BertTokenizerFast
+
+    from liner_notes.model.corpus import load_corpus
+    from liner_notes.model.describe import encoder_max_length
+
+    paths = checkpoints(pattern)
+    if not paths:
+        raise ValueError(f'no checkpoint directories match {pattern}')
+
+    data = load_corpus(corpus, split=split)
+    if limit is not None:
+        data = data.select(range(min(limit, len(data))))
+
+    # tokenized once here, not once per checkpoint
+    tokenizer = BertTokenizerFast.from_pretrained(tokenizer_name)
+    ids = tokenizer(list(data['name']), truncation=True, max_length=encoder_max_length).input_ids
+    notes = list(data['note'])
+
+    cores = os.cpu_count() or 1
+    workers = workers or min(len(paths), cores)
+    threads = max(1, cores // workers)
+
+    results = []
+    # 'spawn' -- workers start with a fresh torch thread pool
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init,
+                             initargs=(tokenizer, ids, notes, threads, batch_size)) as pool:
+        futures = [pool.submit(_evaluate, path) for path in paths]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if verbose:
+                print(f"{result['checkpoint']}  rouge2 {result['rouge2_fmeasure']:.4f}")
+
+    if timing_rows:
+        # one checkpoint at a time, same threads and names for each
+        by_path = {r['checkpoint']: r for r in results}
+        with ProcessPoolExecutor(1, mp_context=context, initializer=_init,
+                                 initargs=(tokenizer, ids, notes, cores, batch_size)) as pool:
+            for path in paths:
+                by_path[path].update(pool.submit(_throughput, path, timing_rows).result())
+                if verbose:
+                    print(f"{path}  {by_path[path]['labels_per_sec']:.2f} labels/s")
+
+    return sorted(results, key=lambda r: r['rouge2_fmeasure'], reverse=True)
+
+
+def table(results):
+    """Ranked results as a plain-text table."""
+    width = max(len('checkpoint'), *(len(r['checkpoint']) for r in results))
+    lines = [
+        f"{'rank':>4}  {'checkpoint':{width}}  {'rouge2 F':>8}  {'95% CI':>15}  "
+        f"{'P':>6}  {'R':>6}  {'labels/s':>9}  {'tokens/s':>9}"
+    ]
+    for rank, r in enumerate(results, 1):
+        ci = f"{r['rouge2_fmeasure_low']:.4f}-{r['rouge2_fmeasure_high']:.4f}"
+        lines.append(
+            f"{rank:>4}  {r['checkpoint']:{width}}  {r['rouge2_fmeasure']:8.4f}  {ci:>15}  "
+            f"{r['rouge2_precision']:6.4f}  {r['rouge2_recall']:6.4f}  "
+            f"{r.get('labels_per_sec', float('nan')):9.2f}  "
+            f"{r.get('tokens_per_sec', float('nan')):9.1f}"
+        )
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('pattern', help="checkpoint glob, e.g. './checkpoint-*'")
+    parser.add_argument('corpus')
+    parser.add_argument('--tokenizer', default='bert-base-uncased')
+    parser.add_argument('--split', default='train')
+    parser.add_argument('--limit', type=int)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--timing-rows', type=int, default=256,
+                        help='names timed per checkpoint, 0 skips the throughput pass')
+    parser.add_argument('--report', help='write the ranked results as JSON')
+    args = parser.parse_args(argv)
+
+    results = sweep(
+        args.pattern, args.corpus,
+        tokenizer_name=args.tokenizer,
+        split=args.split,
+        limit=args.limit,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        timing_rows=args.timing_rows,
+        verbose=True,
+    )
+    print()
+    print(table(results))
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
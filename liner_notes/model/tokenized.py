@@ -0,0 +1,141 @@
+"""On-disk cache of the tokenized corpus shared by the training and evaluation scripts"""
+
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+from datasets import load_from_disk
+
+from liner_notes.model.corpus import load_corpus
+
+
+def model_inputs(batch, tokenizer, max_length):
+    """Fixed-width encoder / decoder inputs and labels for (name, note) rows.
+
+    Names and notes are padded to max_length.  Labels are the note ids
+    with [PAD] replaced by -100 so the loss ignores it, done as one array
+    operation instead of a Python loop over every token.
+
+    """
+    params = {
+        'padding': 'max_length',
+        'truncation': True,
+        'max_length': max_length,
+        'return_tensors': 'np',
+    }
+    inputs = tokenizer(batch['name'], **params)
+    outputs = tokenizer(batch['note'], **params)
+
+    batch['input_ids'] = inputs['input_ids']
+    batch['attention_mask'] = inputs['attention_mask']
+    batch['decoder_input_ids'] = outputs['input_ids']
+    batch['decoder_attention_mask'] = outputs['attention_mask']
+    batch['labels'] = np.where(
+        outputs['input_ids'] == tokenizer.pad_token_id, -100, outputs['input_ids'],
+    )
+
+    return batch
+
+
+def fingerprint(path, split, prepare, tokenizer, **settings):
+    """Hex digest of everything the tokenized corpus depends on.
+
+    The corpus file contents, the split, the source of the prepare
+    function and of this module (prepare may call model_inputs), the
+    tokenizer (class, name, vocabulary size, lower-casing and special
+    tokens) and any extra settings such as max lengths.
+
+    """
+    h = hashlib.sha256()
+
+    with open(os.path.expanduser(path), 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+
+    h.update(json.dumps({
+        'split': split,
+        'prepare': inspect.getsource(prepare),
+        'helpers': inspect.getsource(sys.modules[__name__]),
+        'tokenizer': {
+            'class': type(tokenizer).__name__,
+            'name': tokenizer.name_or_path,
+            'vocab_size': len(tokenizer),
+            'do_lower_case': getattr(tokenizer, 'do_lower_case', None),
+            'special_tokens': tokenizer.special_tokens_map,
+        },
+        'settings': settings,
+    }, sort_keys=True, default=str).encode())
+
+    return h.hexdigest()
+
+
+def load_tokenized(path, split, prepare, tokenizer, cache_dir='./tokenized',
+                   batch_size=1000, remove_columns=None, num_proc=None, **settings):
+    """Tokenized corpus, from the cache when nothing it depends on changed.
+
+    The first call maps prepare over load_corpus(path, split) and saves
+    the result as Arrow under cache_dir/<fingerprint>.  Later calls with
+    the same corpus, split, prepare source, tokenizer and settings
+    memory-map it instead of tokenizing again.  Any change gives a new
+    fingerprint, so a stale cache is never read.
+
+    Parameters
+    ----------
+    path : string
+        corpus file understood by load_corpus
+    split : string
+        e.g. 'train[:90%]'
+    prepare : callable
+        batched datasets map function, e.g. ed.process_data_to_model_inputs
+    tokenizer : transformers.PreTrainedTokenizer
+        the tokenizer prepare uses
+    cache_dir : string, default './tokenized'
+    batch_size : int, default 1000
+        map batch size
+    remove_columns : list, default None
+        columns dropped by the map
+    num_proc : int, default None
+        processes tokenizing shards of the corpus, None tokenizes in
+        this process; does not change the result or the fingerprint
+    **settings
+        anything else prepare depends on, e.g. encoder_max_length=128
+
+    Returns
+    -------
+    ds : datasets.Dataset
+
+    Example
+    -------
+    >>> train_data = load_tokenized(
+    ...     corpus_file, 'train[:90%]', process_data_to_model_inputs,
+    ...     tokenizer, remove_columns=['name', 'note'],
+    ...     encoder_max_length=128, decoder_max_length=512,
+    ... )
+
+    """
+    key = fingerprint(path, split, prepare, tokenizer,
+                      remove_columns=remove_columns, **settings)
+    target = os.path.join(os.path.expanduser(cache_dir), key)
+
+    if not os.path.isdir(target):
+        ds = load_corpus(path, split=split).map(
+            prepare,
+            batched=True,
+            batch_size=batch_size,
+            remove_columns=remove_columns,
+            num_proc=num_proc,
+        )
+        # write beside the target and rename, so an interrupted run
+        # never leaves a half-written cache behind
+        tmp = f'{target}.{os.getpid()}.tmp'
+        ds.save_to_disk(tmp)
+        try:
+            os.rename(tmp, target)
+        except OSError:  # another process finished first
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    return load_from_disk(target)
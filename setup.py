@@ -3,7 +3,10 @@ from setuptools import setup
 setup(
     name='liner_notes',
     version='0.1',
-    packages=['liner_notes', 'liner_notes.data'],
+    packages=['liner_notes', 'liner_notes.data', 'liner_notes.model'],
+    entry_points={
+        'console_scripts': ['liner-notes=liner_notes.cli:main'],
+    },
     url='https://github.com/pablomitchell/liner-notes',
     license='',
     author='pablo mitchell',